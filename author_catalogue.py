@@ -0,0 +1,190 @@
+# Local catalogue of Gutenberg authors: which books each author (or translator, editor etc.) worked on and
+# whether Gutenberg already links to a Wikipedia page for them.
+# Step 5 used to download the author's page on gutenberg.org just for this. Instead we build the catalogue once from
+# Gutenberg's bulk RDF catalog (rdf-files.tar.bz2, one pg{id}.rdf file per book) with "python author_catalogue.py",
+# and every run adds the books published since then from their individual RDF files. Books whose RDF file couldn't
+# be fetched (an error, or not there yet) are remembered and tried again by the next runs, up to FETCH_ATTEMPTS times.
+# The catalogue lives in the local sqlite database (see cache.py), indexed by author id.
+
+import asyncio
+import os
+import re
+import sys
+import tarfile
+import xml.etree.ElementTree as ElementTree
+import cpu_pool
+from cache import define_table, execute, execute_many
+from utils import get_http_client
+
+CATALOG_URL = "https://www.gutenberg.org/cache/epub/feeds/rdf-files.tar.bz2"
+CATALOG_FILE = "cache/rdf-files.tar.bz2"
+BOOK_RDF_URL = "https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}.rdf"
+MAX_TITLES = 25  # the author page on gutenberg.org lists this many books (most downloaded first)
+MAX_INCREMENTAL_BOOKS = 2000  # with a larger gap it's faster to rebuild from the bulk catalog
+UPDATE_CONCURRENCY = 8
+INSERT_BATCH_SIZE = 5000
+FETCH_ATTEMPTS = 5
+HEADERS = {'User-Agent': 'Mozilla/5.0 (compatible; GutenbergCatalogue/1.0; +https://github.com)'}
+
+NAMESPACES = {
+    'rdf': "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    'pgterms': "http://www.gutenberg.org/2009/pgterms/",
+    'dcterms': "http://purl.org/dc/terms/",
+}
+RDF_ABOUT = f"{{{NAMESPACES['rdf']}}}about"
+RDF_RESOURCE = f"{{{NAMESPACES['rdf']}}}resource"
+
+define_table("create table if not exists catalogue_books (book_id integer primary key, title text, downloads integer)")
+define_table("""create table if not exists catalogue_contributors (
+    book_id integer, author_id text, role text, primary key (book_id, author_id, role))""")
+define_table("create index if not exists catalogue_contributors_author on catalogue_contributors (author_id)")
+define_table("create table if not exists catalogue_authors (author_id text primary key, name text, has_wiki_link integer)")
+define_table("create table if not exists catalogue_missing (book_id integer primary key, attempts integer)")
+
+
+def parse_book_rdf(data):
+    """Return (book_id, title, downloads, [(author_id, name, role, has_wiki_link)]) from a pg{id}.rdf file."""
+    root = ElementTree.fromstring(data)
+    ebook = root.find('pgterms:ebook', NAMESPACES)
+    if ebook is None:
+        return None
+    book_id = int(ebook.get(RDF_ABOUT).split("/")[-1])
+    title = ebook.findtext('dcterms:title', "", NAMESPACES)
+    downloads = ebook.findtext('pgterms:downloads', "0", NAMESPACES)
+
+    # An agent is described in full the first time it appears, later roles only refer to it
+    agents = {}
+    for agent in root.iter(f"{{{NAMESPACES['pgterms']}}}agent"):
+        webpages = [page.get(RDF_RESOURCE, "") for page in agent.findall('pgterms:webpage', NAMESPACES)]
+        agents[agent.get(RDF_ABOUT)] = (
+            agent.findtext('pgterms:name', "", NAMESPACES),
+            any("wikipedia.org" in page for page in webpages)
+        )
+
+    contributors = []
+    for element in ebook:
+        agent = element.find('pgterms:agent', NAMESPACES)
+        agent_ref = agent.get(RDF_ABOUT) if agent is not None else element.get(RDF_RESOURCE, "")
+        if "/agents/" in agent_ref and agent_ref in agents:
+            role = element.tag.split("}")[-1]
+            name, has_wiki_link = agents[agent_ref]
+            contributors.append((agent_ref.split("/")[-1], name, role, has_wiki_link))
+
+    # Subtitles follow the title on a new line, the author page only shows the title
+    title = title.strip().splitlines()[0].strip() if title.strip() else ""
+    return book_id, title, int(downloads) if downloads.isdigit() else 0, contributors
+
+
+def add_books(books):
+    """Store parsed books (see parse_book_rdf) in the catalogue."""
+    execute_many(
+        "insert or replace into catalogue_books (book_id, title, downloads) values (?, ?, ?)",
+        [(book_id, title, downloads) for book_id, title, downloads, _ in books]
+    )
+    execute_many(
+        "insert or ignore into catalogue_contributors (book_id, author_id, role) values (?, ?, ?)",
+        [(book_id, author_id, role) for book_id, _, _, contributors in books for author_id, _, role, _ in contributors]
+    )
+    execute_many(
+        "insert or replace into catalogue_authors (author_id, name, has_wiki_link) values (?, ?, ?)",
+        [(author_id, name, int(has_wiki_link)) for *_, contributors in books for author_id, name, _, has_wiki_link in contributors]
+    )
+
+
+def build_from_archive(path=CATALOG_FILE):
+    """(Re)build the catalogue from the bulk RDF catalog, downloading it first if needed. Returns the number of books."""
+    if not os.path.exists(path):
+        import requests
+
+        print(f"Downloading {CATALOG_URL}...")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with requests.get(CATALOG_URL, headers=HEADERS, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(path + ".part", "wb") as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        os.replace(path + ".part", path)
+
+    count = 0
+    batch = []
+    with tarfile.open(path, "r:*") as archive:
+        for member in archive:
+            if not member.isfile() or not re.search(r"pg\d+\.rdf$", member.name):
+                continue
+            if book := parse_book_rdf(archive.extractfile(member).read()):
+                batch.append(book)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                add_books(batch)
+                count += len(batch)
+                batch = []
+    add_books(batch)
+    execute("delete from catalogue_missing")
+    return count + len(batch)
+
+
+def latest_book_id():
+    """Return the highest book id in the catalogue (0 if it hasn't been built)."""
+    return execute("select coalesce(max(book_id), 0) from catalogue_books")[0][0]
+
+
+async def fetch_book_async(book_id):
+    """Download and parse the RDF file of a single book, or return None if it doesn't exist."""
+    response = await get_http_client().get(BOOK_RDF_URL.format(book_id=book_id), headers=HEADERS)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return await cpu_pool.call_async(parse_book_rdf, response.content)
+
+
+async def update_async(up_to_book_id):
+    """Add the books published since the catalogue was last updated and earlier missing ones. Returns the number added."""
+    start_id = latest_book_id()
+    if not start_id:
+        return 0
+    if up_to_book_id - start_id > MAX_INCREMENTAL_BOOKS:
+        print(f"Author catalogue is {up_to_book_id - start_id} books behind, rebuild it with: python author_catalogue.py")
+        return 0
+    missing = dict(execute("select book_id, attempts from catalogue_missing"))
+    book_ids = sorted(set(missing).union(range(start_id + 1, up_to_book_id + 1)))
+    if not book_ids:
+        return 0
+
+    semaphore = asyncio.Semaphore(UPDATE_CONCURRENCY)
+
+    async def fetch(book_id):
+        async with semaphore:
+            try:
+                return await fetch_book_async(book_id)
+            except Exception:
+                return None
+
+    books = await asyncio.gather(*(fetch(book_id) for book_id in book_ids))
+    add_books([book for book in books if book])
+
+    # Only ids after the highest stored book would be fetched again without this
+    failed = [(book_id, missing.get(book_id, 0) + 1) for book_id, book in zip(book_ids, books) if not book]
+    execute_many("delete from catalogue_missing where book_id = ?", [(book_id,) for book_id in missing])
+    execute_many(
+        "insert or replace into catalogue_missing (book_id, attempts) values (?, ?)",
+        [(book_id, attempts) for book_id, attempts in failed if attempts < FETCH_ATTEMPTS]
+    )
+    return len(book_ids) - len(failed)
+
+
+def get_author(author_id):
+    """Return {'book_titles', 'has_wiki_link'} for an author in the catalogue, or None if the author is unknown."""
+    rows = execute("select has_wiki_link from catalogue_authors where author_id = ?", (str(author_id),))
+    if not rows:
+        return None
+    titles = execute(
+        """select distinct b.title, b.downloads from catalogue_contributors c join catalogue_books b on b.book_id = c.book_id
+        where c.author_id = ? order by b.downloads desc, b.book_id limit ?""",
+        (str(author_id), MAX_TITLES)
+    )
+    return {'book_titles': [title for title, _ in titles], 'has_wiki_link': bool(rows[0][0])}
+
+
+if __name__ == "__main__":
+    count = build_from_archive(sys.argv[1] if len(sys.argv) > 1 else CATALOG_FILE)
+    authors = execute("select count(*) from catalogue_authors")[0][0]
+    print(f"Author catalogue: {count} books, {authors} authors")
@@ -0,0 +1,80 @@
+# Benchmarks the lxml based page parsing (html_parsing.py) against the original BeautifulSoup versions.
+# Run from the repository root with saved gutenberg.org book pages:
+#   python -m benchmarks.parse_gutenberg_pages path/to/pg*.html
+# Without arguments it uses cache/books/*.html (see "python profiling.py record"), and synthetic pages if there
+# are none. Prints timings per page and lists the pages where the two versions return different values.
+
+import glob
+import sys
+from html_parsing import parse_book_metadata, parse_author_page, parse_latest_book_id
+import legacy
+from benchmarks.strip_gutenberg_wrapper import best_of
+
+
+def synthetic_pages():
+    """Yield (name, kind, html) for made-up pages shaped like the ones on gutenberg.org."""
+    navigation = "".join(f'<li><a href="/help/{i}">Help {i}</a></li>' for i in range(60))
+    page = ('<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><title>{title}</title>'
+            + "".join(f'<link rel="stylesheet" href="/style{i}.css">' for i in range(10))
+            + '</head><body><div id="page"><ul class="nav">' + navigation + '</ul>'
+            + '<div id="content" class="page_content">{body}</div></div></body></html>')
+
+    rows = [('Author', '<a href="/ebooks/author/1234">Dickens, Charles, 1812-1870</a>'),
+            ('Translator', '<a href="/ebooks/author/99">Müller, Jürgen, 1901-</a>'),
+            ('Illustrator', '<a href="/ebooks/author/77">Phiz, 1815-1882</a>'),
+            ('Title', 'Bleak House'), ('Language', 'English'), ('LoC Class', 'PR: Language and Literatures'),
+            ('Subject', 'Domestic fiction'), ('Subject', 'London (England) -- Fiction'),
+            ('Category', 'Text'), ('EBook-No.', '1023'), ('Release Date', 'Aug 1, 1997'),
+            ('Copyright Status', 'Public domain in the USA.'), ('Downloads', '3421 downloads in the last 30 days.')]
+    bibrec = '<table class="bibrec" summary="Bibliographic data">' + "".join(
+        f'<tr property="dcterms:x"><th>{header}</th><td>{value}</td></tr>' for header, value in rows) + '</table>'
+    downloads = '<table class="files">' + "".join(
+        f'<tr class="even"><td><a href="/ebooks/1023.epub{i}">EPUB {i}</a></td><td>{i * 100} kB</td></tr>' for i in range(12)) + '</table>'
+    book_body = '<h1 itemprop="name">Bleak House by Charles Dickens</h1><div id="tabs">' + downloads + bibrec + '</div>'
+    yield "synthetic_book_page", "book", page.format(title="Bleak House", body=book_body)
+    # Some pages are XHTML starting with an XML declaration, which lxml only accepts in bytes
+    xhtml = '<?xml version="1.0" encoding="utf-8"?>\n' + page.format(title="Bleak House", body=book_body)
+    yield "synthetic_xhtml_book_page", "book", xhtml.encode('utf-8')
+
+    booklinks = "".join(
+        f'<li class="booklink"><a class="link" href="/ebooks/{i}"><span class="cell content">'
+        f'<span class="title">Title {i}</span><span class="subtitle">Charles Dickens</span>'
+        f'<span class="extra">{i} downloads</span></span></a></li>' for i in range(25))
+    author_body = ('<h1>Books by Dickens, Charles</h1><a href="https://en.wikipedia.org/wiki/Charles_Dickens">Wikipedia</a>'
+                   f'<ul class="results">{booklinks}</ul>')
+    yield "synthetic_author_page", "author", page.format(title="Books by Dickens, Charles", body=author_body)
+
+    latest = "".join(f'<a href="/ebooks/{75000 - i}"><img src="/cover{i}.jpg" alt="Book {i}"></a>' for i in range(40))
+    yield "synthetic_homepage", "homepage", page.format(title="Project Gutenberg", body=latest)
+
+
+PARSERS = {
+    'book': (legacy.parse_book_metadata, parse_book_metadata),
+    'author': (legacy.parse_author_page, parse_author_page),
+    'homepage': (legacy.parse_latest_book_id, parse_latest_book_id),
+}
+
+
+def main(paths):
+    pages = [(path, 'book', open(path, 'rb').read()) for path in paths] or list(synthetic_pages())
+    totals = {'original': 0.0, 'lxml': 0.0}
+    differences = []
+
+    print(f"{'page':40} {'size':>7} {'original':>10} {'lxml':>10}")
+    for name, kind, html in pages:
+        original, new = PARSERS[kind]
+        timings = {'original': best_of(original, html), 'lxml': best_of(new, html)}
+        for key, value in timings.items():
+            totals[key] += value
+        print(f"{name[-40:]:40} {len(html) // 1024:>5}KB " + " ".join(f"{value * 1000:>8.2f}ms" for value in timings.values()))
+
+        if original(html) != new(html):
+            differences.append(name)
+
+    print("\nTotal: " + ", ".join(f"{key} {value * 1000:.1f}ms" for key, value in totals.items()))
+    print(f"Speed-up: {totals['original'] / totals['lxml']:.1f}x")
+    print(f"Different output for {len(differences)} of {len(pages)} pages" + (":\n  " + "\n  ".join(differences) if differences else ""))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or sorted(glob.glob("cache/books/*.html")))
@@ -0,0 +1,84 @@
+# Benchmarks find_gutenberg_boundaries()/remove_gutenberg_wrapper() against the original line-based version.
+# Run from the repository root with raw Gutenberg .txt files (header and footer included):
+#   python -m benchmarks.strip_gutenberg_wrapper path/to/pg*.txt
+# Without arguments it uses cache/books/*.txt, and synthetic books if there are none.
+# Prints timings per file and lists the files where the two versions produce different output
+# (expected for legacy header/footer formats the original version didn't recognise). Afterwards both versions are
+# compared on random short texts made of marker lines (repeated and consecutive ones too), whitespace and text.
+
+import glob
+import random
+import sys
+import time
+from utils import find_gutenberg_boundaries, remove_gutenberg_wrapper
+from legacy import remove_gutenberg_wrapper as original_remove_gutenberg_wrapper
+
+
+def synthetic_books():
+    """Yield (name, text) for made-up books in the current format, from 100 KB to 5 MB."""
+    header = "The Project Gutenberg eBook of Test\n\nTitle: Test\n\n*** START OF THE PROJECT GUTENBERG EBOOK TEST ***\n"
+    footer = "\n*** END OF THE PROJECT GUTENBERG EBOOK TEST ***\n\n" + "Full license text.\n" * 400
+    line = "It was a bright cold day in April, and the clocks were striking thirteen.\n"
+    for size_kb in (100, 1000, 5000):
+        yield f"synthetic_{size_kb}kb", header + line * (size_kb * 1024 // len(line)) + footer
+    # Start marker repeated on consecutive lines and again later in the header
+    repeated = header + header.split("\n")[-2] + "\n\n\xa0\n" + header.split("\n")[-2] + "\n"
+    yield "synthetic_repeated_markers", repeated + line * (1000 * 1024 // len(line)) + footer + footer
+
+
+RANDOM_LINES = [
+    "*** START OF THE PROJECT GUTENBERG EBOOK TEST ***", "*** END OF THE PROJECT GUTENBERG EBOOK TEST ***",
+    "*** START OF", "*** END OF", "Some text.", "Text *** START OF in a line", "", " ", "\t", "\r", "\xa0",
+]
+
+
+def random_differences(count=50000, seed=0):
+    """Return the random texts (of up to 8 lines from RANDOM_LINES) for which both versions differ."""
+    rng = random.Random(seed)
+    differences = []
+    for _ in range(count):
+        text = "\n".join(rng.choice(RANDOM_LINES) for _ in range(rng.randint(0, 8))) + rng.choice(["", "\n"])
+        if original_remove_gutenberg_wrapper(text) != remove_gutenberg_wrapper(text):
+            differences.append(text)
+    return differences
+
+
+def best_of(function, argument, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main(paths):
+    books = [(path, open(path, encoding='utf-8', errors='replace').read()) for path in paths] or list(synthetic_books())
+    totals = {'original': 0.0, 'new (str)': 0.0, 'offsets (bytes)': 0.0}
+    differences = []
+
+    print(f"{'book':40} {'size':>9} {'original':>10} {'new (str)':>10} {'offsets':>10}")
+    for name, text in books:
+        raw = text.encode('utf-8')
+        timings = {
+            'original': best_of(original_remove_gutenberg_wrapper, text),
+            'new (str)': best_of(remove_gutenberg_wrapper, text),
+            'offsets (bytes)': best_of(find_gutenberg_boundaries, memoryview(raw)),
+        }
+        for key, value in timings.items():
+            totals[key] += value
+        print(f"{name[-40:]:40} {len(raw) // 1024:>7}KB " + " ".join(f"{value * 1000:>8.2f}ms" for value in timings.values()))
+
+        if original_remove_gutenberg_wrapper(text) != remove_gutenberg_wrapper(text):
+            differences.append(name)
+
+    print("\nTotal: " + ", ".join(f"{key} {value * 1000:.1f}ms" for key, value in totals.items()))
+    print(f"Speed-up (str): {totals['original'] / totals['new (str)']:.1f}x")
+    print(f"Different output for {len(differences)} of {len(books)} books" + (":\n  " + "\n  ".join(differences) if differences else ""))
+
+    random_texts = random_differences()
+    print(f"Different output for {len(random_texts)} of 50000 random texts" + "".join(f"\n  {text!r}" for text in random_texts[:5]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or sorted(glob.glob("cache/books/*.txt")))
@@ -0,0 +1,140 @@
+# Plans how each book is processed so that a run stays within a budget of time and/or money.
+# "python main.py --budget-dollars 15 --deadline-minutes 240" estimates, before the steps of each book run, what the
+# book will cost with each of the PLANS below (from the length of its text, the model prices in usage.py and the
+# step durations) and picks the most thorough plan that still lets the remaining books fit into what is left of the
+# budget. Books are planned one at a time with the actual spend so far, so the plan adapts when estimates are off.
+# The plans differ in:
+# - validation: the whole cascade (see wiki_for_books.py) or only the small model
+# - summary: from the Wikipedia article when there is one, or always from the book content (no article downloads)
+#   and the number of tokens of the book sent to GPT
+# - readability: from the entire text or a sample of it (see readability.py)
+# At the end the planned and actual spend per step are reported. The ratio between them is remembered (in the local
+# database) and corrects the estimates of later runs. Perplexity (author step) and Serper costs aren't tracked.
+
+import time
+from collections import Counter, defaultdict
+from cache import DiskCache
+from usage import PRICES, get_cost_by_step
+import events
+
+PLANS = [
+    {'name': "full", 'validation_tiers': None, 'wiki_summary': True, 'summary_tokens': 24000, 'readability_sample': None},
+    {'name': "reduced", 'validation_tiers': 1, 'wiki_summary': True, 'summary_tokens': 24000, 'readability_sample': 200000},
+    {'name': "minimal", 'validation_tiers': 1, 'wiki_summary': False, 'summary_tokens': 8000, 'readability_sample': 100000},
+]
+FULL_PLAN = PLANS[0]
+
+# Estimates per book before any calibration
+DEFAULT_DOLLARS = {'book_wikipedia': 0.004, 'categories': 0.004}
+DEFAULT_SECONDS = {'fetch': 3, 'book_wikipedia': 20, 'summary': 20, 'categories': 5, 'author_wikipedia': 10}
+SMALL_VALIDATION_SHARE = 0.6  # of the validation cost and time when only the small model is asked
+CONTENT_SUMMARY_SHARE = 0.8  # of the summary time when no Wikipedia articles are downloaded
+READABILITY_SECONDS_PER_CHAR = 3e-6
+BOOK_OVERHEAD_SECONDS = 5  # the pause after each of the five steps
+CHARS_PER_TOKEN = 4
+SUMMARY_MODEL = "gpt-5.2"
+SUMMARY_OUTPUT_TOKENS = 500
+
+# Usage steps (see usage.py) per pipeline step
+USAGE_STEPS = {
+    'validation': 'book_wikipedia',
+    'summary': 'summary', 'summary (map)': 'summary', 'wiki summary': 'summary',
+    'categories': 'categories',
+}
+
+calibration = DiskCache("budget_calibration")
+
+
+def estimate(plan, text_chars):
+    """Return ({step: dollars}, {step: seconds}) that a book with text_chars characters is expected to take with plan."""
+    small_validation = plan['validation_tiers'] == 1
+    input_price, _, output_price = PRICES[SUMMARY_MODEL]
+    summary_tokens = min(text_chars // CHARS_PER_TOKEN, plan['summary_tokens'])
+    readability_chars = min(text_chars, plan['readability_sample'] or text_chars)
+
+    dollars = {
+        'book_wikipedia': DEFAULT_DOLLARS['book_wikipedia'] * (SMALL_VALIDATION_SHARE if small_validation else 1),
+        'summary': (summary_tokens * input_price + SUMMARY_OUTPUT_TOKENS * output_price) / 1e6,
+        'categories': DEFAULT_DOLLARS['categories'],
+    }
+    seconds = dict(DEFAULT_SECONDS)
+    seconds['book_wikipedia'] *= SMALL_VALIDATION_SHARE if small_validation else 1
+    seconds['summary'] *= 1 if plan['wiki_summary'] else CONTENT_SUMMARY_SHARE
+    seconds['readability'] = readability_chars * READABILITY_SECONDS_PER_CHAR
+
+    dollars = {step: value * calibration.get(f"dollars:{step}", 1.0) for step, value in dollars.items()}
+    seconds = {step: value * calibration.get(f"seconds:{step}", 1.0) for step, value in seconds.items()}
+    return dollars, seconds
+
+
+def get_actual_dollars():
+    """Return the dollars spent so far per pipeline step."""
+    actual = defaultdict(float)
+    for usage_step, dollars in get_cost_by_step().items():
+        actual[USAGE_STEPS.get(usage_step, usage_step)] += dollars
+    return dict(actual)
+
+
+class BudgetPlanner:
+    """Picks a plan for each book of a run so that the run fits into max_dollars and/or max_seconds."""
+
+    def __init__(self, total_books, max_dollars=None, max_seconds=None, concurrency=1):
+        self.remaining_books = total_books
+        self.max_dollars = max_dollars
+        self.max_seconds = max_seconds
+        self.concurrency = concurrency
+        self.started = time.monotonic()
+        self.planned_dollars = Counter()
+        self.planned_seconds = Counter()
+        self.plan_counts = Counter()
+
+    def plan_book(self, book_id, text_chars):
+        """Return the most thorough plan for this book that leaves enough budget for the remaining books."""
+        books = max(self.remaining_books, 1)
+        spent = sum(get_actual_dollars().values())
+        elapsed = time.monotonic() - self.started
+
+        chosen = PLANS[-1]
+        for plan in PLANS:
+            dollars, seconds = estimate(plan, text_chars)
+            book_seconds = (sum(seconds.values()) + BOOK_OVERHEAD_SECONDS) / self.concurrency
+            fits_money = self.max_dollars is None or spent + sum(dollars.values()) * books <= self.max_dollars
+            fits_time = self.max_seconds is None or elapsed + book_seconds * books <= self.max_seconds
+            if fits_money and fits_time:
+                chosen = plan
+                break
+
+        dollars, seconds = estimate(chosen, text_chars)
+        self.planned_dollars.update(dollars)
+        self.planned_seconds.update(seconds)
+        self.plan_counts[chosen['name']] += 1
+        self.remaining_books -= 1
+        return chosen
+
+    def format_report(self):
+        """Return planned vs actual dollars and seconds per step."""
+        actual_dollars = get_actual_dollars()
+        lines = [
+            "Budget: " + ", ".join(f"{count} books {name}" for name, count in self.plan_counts.items()),
+            f"  {'step':18} {'planned $':>10} {'actual $':>10} {'planned s':>10} {'actual s':>10}",
+        ]
+        for step in dict.fromkeys([*self.planned_seconds, *self.planned_dollars]):
+            lines.append(
+                f"  {step:18} {self.planned_dollars[step]:>10.2f} {actual_dollars.get(step, 0):>10.2f} "
+                f"{self.planned_seconds[step]:>10.0f} {events.step_seconds[step]:>10.0f}"
+            )
+        lines.append(
+            f"  {'total':18} {sum(self.planned_dollars.values()):>10.2f} {sum(actual_dollars.values()):>10.2f} "
+            f"{'':>10} {time.monotonic() - self.started:>10.0f}"
+        )
+        return "\n".join(lines)
+
+    def save_calibration(self):
+        """Remember how far off this run's estimates were, for the estimates of the next runs."""
+        actual_dollars = get_actual_dollars()
+        for kind, planned, actual in [("dollars", self.planned_dollars, actual_dollars), ("seconds", self.planned_seconds, events.step_seconds)]:
+            for step, planned_value in planned.items():
+                if planned_value and actual.get(step):
+                    previous = calibration.get(f"{kind}:{step}", 1.0)
+                    # Half the old correction, half this run's, so one unusual run doesn't throw the estimates off
+                    calibration.set(f"{kind}:{step}", previous * (0.5 + 0.5 * actual[step] / planned_value))
@@ -0,0 +1,83 @@
+# Local persistent storage for things we want to remember across runs (caches, indexes).
+# Everything lives in a single sqlite database in "cache/" which is not committed.
+# DiskCache is a simple key-value table with optional expiry, values are stored as JSON.
+# Tables are created when the database is first used, so importing a module that defines one costs nothing.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DATABASE_FILE = "cache/pipeline.sqlite3"
+
+_connection = None
+_lock = threading.RLock()
+_schema = []
+
+
+def get_db():
+    """Return the shared sqlite connection, creating the database on first use."""
+    global _connection
+    with _lock:
+        if _connection is None:
+            os.makedirs(os.path.dirname(DATABASE_FILE), exist_ok=True)
+            _connection = sqlite3.connect(DATABASE_FILE, check_same_thread=False, isolation_level=None)
+            _connection.execute("pragma journal_mode=wal")
+            for sql in _schema:
+                _connection.execute(sql)
+        return _connection
+
+
+def define_table(sql):
+    """Register a "create table/index if not exists" statement, run when the database is opened (right away if it is)."""
+    with _lock:
+        _schema.append(sql)
+        if _connection is not None:
+            _connection.execute(sql)
+
+
+def execute(sql, params=()):
+    """Run a statement on the shared connection and return all result rows."""
+    with _lock:
+        return get_db().execute(sql, params).fetchall()
+
+
+def execute_many(sql, rows):
+    """Run a statement for each of rows in a single transaction."""
+    with _lock:
+        db = get_db()
+        db.execute("begin")
+        try:
+            db.executemany(sql, rows)
+            db.execute("commit")
+        except Exception:
+            db.execute("rollback")
+            raise
+
+
+class DiskCache:
+    """Key-value store in its own table of the local database. Entries older than ttl seconds are ignored."""
+
+    def __init__(self, table, ttl=None):
+        self.table = table
+        self.ttl = ttl
+        define_table(f"create table if not exists {table} (key text primary key, value text, created real)")
+
+    def get(self, key, default=None):
+        rows = execute(f"select value, created from {self.table} where key = ?", (key,))
+        if not rows:
+            return default
+        value, created = rows[0]
+        if self.ttl is not None and time.time() - created > self.ttl:
+            return default
+        return json.loads(value)
+
+    def set(self, key, value):
+        execute(f"insert or replace into {self.table} (key, value, created) values (?, ?, ?)", (key, json.dumps(value), time.time()))
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+
+_missing = object()
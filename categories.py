@@ -1,27 +1,72 @@
 # Assigns a book to one or more predefined categories using ChatGPT.
 # We have 72 predefined categories in total listed in categories.txt.
 # We're using a schema to force ChatGPT to pick only from our predefined list and return the result as a list of strings.
+# The system prompt, instruction and acknowledgment are identical for every book and come first, so OpenAI serves them
+# from its prompt cache; only the summary at the end changes from book to book.
+# Category assignment only depends on the summary, so several books can also be categorised in one request
+# (get_categories_batch). The schema then has one category list per book id; if a batch comes back invalid it's
+# split in halves until it works, down to the normal one-book request.
+# The version of categories.txt (a hash of its contents) that each book was categorised with is remembered in the
+# local database, so that books can be re-categorised when categories.txt changes (see recategorise.py).
 
-from openai import OpenAI
+import asyncio
+import functools
+import hashlib
 import json
-import os
+import time
 from dotenv import load_dotenv
+from utils import get_openai_client, run_sync
+from usage import record_openai_usage
+from cache import define_table, execute
+from results_writer import after_write, append_lines
 
 load_dotenv()
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+define_table("create table if not exists category_versions (version text primary key, content text, recorded real)")
+define_table("create table if not exists category_assignments (book_id integer primary key, version text, category_ids text)")
 
-def _load_categories():
-    """Parse categories.txt and return: name-to-id dict, category names list, newline-joined category names."""
+
+def parse_categories(content):
+    """Return [(category id, name)] from the contents of a categories.txt file."""
+    return [tuple(line.strip().split(", ", 1)) for line in content.splitlines() if line.strip()]
+
+
+def store_categories_version(content, recorded=None):
+    """Store the contents of a categories.txt file and return its version."""
+    version = hashlib.sha256(content.encode()).hexdigest()[:12]
+    execute(
+        "insert or ignore into category_versions (version, content, recorded) values (?, ?, ?)",
+        (version, content, time.time() if recorded is None else recorded)
+    )
+    return version
+
+
+@functools.cache
+def load_categories_version():
+    """Return (version, contents) of categories.txt, storing the contents under the version on first use."""
+    with open("categories.txt") as f:
+        content = f.read()
+    return store_categories_version(content), content
+
+
+@functools.cache
+def load_categories():
+    """Parse categories.txt (on first use) and return: name-to-id dict, category names list, newline-joined category names."""
     with open("categories.txt") as f:
-        id_name_pairs = [line.strip().split(", ", 1) for line in f]
+        id_name_pairs = parse_categories(f.read())
 
     name_to_id = {name: cat_id for cat_id, name in id_name_pairs}  # Dict for looking up IDs
     category_names = [name for _, name in id_name_pairs]  # List of names
     category_names_text = "\n".join(category_names)  # Newline-joined text for prompts
     return name_to_id, category_names, category_names_text
 
-name_to_id, category_names, category_names_text = _load_categories()
+
+def __getattr__(name):
+    """name_to_id, category_names and category_names_text are read from categories.txt when first used."""
+    attributes = ("name_to_id", "category_names", "category_names_text")
+    if name in attributes:
+        return load_categories()[attributes.index(name)]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 system_prompt_template = """You are an expert at choosing appropriate categories for books. You do this by thoroughly reading the summary of a book to cultivate an understanding of what the book is about. In doing so you think critically about what the central topic or topics of the book are and what the peripheral topic or topics are. Just because certain "matching words" appear in the summary does not mean that the book is about that topic. You must read the summary carefully and think about what the book is actually about. Then and only then you pick appropriate categories for the book from this particular list of available categories:
@@ -45,8 +90,9 @@ user_instruction = """I will give you the summary of a book. Your job is to read
 assistant_acknowledgment = "Ok, please give me the summary of the book. I will read it thoroughly and based on my understanding pick the categories that are relevant for this book. When picking the categories I will bear in mind that these will be used by people to find books that are relevant to them. So I'll make sure to pick categories according to what people may expect to find in each category."
 
 
-def _build_response_schema():
+def _build_response_schema(names=None):
     """Build the JSON schema for GPT response."""
+    names = names or load_categories()[1]
     return {
         "name": "book_categories",
         "schema": {
@@ -55,7 +101,7 @@ def _build_response_schema():
                 "categories": {
                     "type": "array",
                     "description": "Chosen category or categories for the particular book.",
-                    "items": {"type": "string", "enum": category_names}
+                    "items": {"type": "string", "enum": names}
                 }
             },
             "required": ["categories"],
@@ -65,20 +111,68 @@ def _build_response_schema():
     }
 
 
-def get_categories(book_id, summary):
-    """Assigns book to categories using GPT based on summary."""
-    system_prompt = system_prompt_template.format(category_names_text=category_names_text)
+def _build_batch_response_schema(book_ids):
+    """Build the JSON schema for a GPT response that categorises several books, keyed by book id."""
+    # The category list is defined once and referenced per book: Structured Outputs allows at most 1000 enum values
+    # per schema, a copy of the list for each of 20 books would be far more
+    return {
+        "name": "books_categories",
+        "schema": {
+            "type": "object",
+            "properties": {str(book_id): {"$ref": "#/$defs/categories"} for book_id in book_ids},
+            "required": [str(book_id) for book_id in book_ids],
+            "additionalProperties": False,
+            "$defs": {
+                "categories": {
+                    "type": "array",
+                    "description": "Chosen category or categories for the book.",
+                    "items": {"type": "string", "enum": load_categories()[1]}
+                }
+            }
+        },
+        "strict": True
+    }
+
+
+CATEGORY_BATCH_SIZE = 20
+
+batch_note = """This time I will give you the summaries of several books at once, each marked with its book id. Treat every book completely separately and pick the categories for each one exactly as you would if it was the only book. Return the categories keyed by book id."""
+
 
-    response = openai_client.beta.chat.completions.parse(
+@functools.cache
+def get_static_prompt():
+    """Return (static messages, response schema).
+
+    Built once on first use - these never change during a run and must be byte-identical across requests for prompt caching.
+    """
+    static_messages = [
+        {"role": "system", "content": system_prompt_template.format(category_names_text=load_categories()[2])},
+        {"role": "user", "content": user_instruction},
+        {"role": "assistant", "content": assistant_acknowledgment}
+    ]
+    return static_messages, _build_response_schema()
+
+
+async def get_categories_async(book_id, summary, candidates=None):
+    """Assigns book to categories using GPT based on summary.
+
+    candidates optionally restricts the prompt and schema to a pre-selected subset of the categories (see category_index.py).
+    """
+    static_messages, response_schema = get_static_prompt()
+    if candidates:
+        system_prompt = system_prompt_template.format(category_names_text="\n".join(candidates))
+        messages = [{"role": "system", "content": system_prompt}] + static_messages[1:]
+        request_options = {"response_format": {"type": "json_schema", "json_schema": _build_response_schema(candidates)}}
+    else:
+        messages = static_messages
+        request_options = {"response_format": {"type": "json_schema", "json_schema": response_schema}, "prompt_cache_key": "book_categories"}
+
+    response = await get_openai_client().beta.chat.completions.parse(
         model="gpt-5.2",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_instruction},
-            {"role": "assistant", "content": assistant_acknowledgment},
-            {"role": "user", "content": f"<summary>{summary}</summary>"}
-        ],
-        response_format={"type": "json_schema", "json_schema": _build_response_schema()}
+        messages=messages + [{"role": "user", "content": f"<summary>{summary}</summary>"}],
+        **request_options
     )
+    record_openai_usage("categories", "gpt-5.2", response.usage)
 
     if not response.choices or not response.choices[0].message.content:
         raise ValueError(f"Empty response from OpenAI for book {book_id}")
@@ -86,10 +180,128 @@ def get_categories(book_id, summary):
     return json.loads(response.choices[0].message.content)["categories"]
 
 
+def get_categories(book_id, summary, candidates=None):
+    """Assigns book to categories using GPT based on summary."""
+    return run_sync(get_categories_async(book_id, summary, candidates))
+
+
+async def _categorise_batch(summaries):
+    """Categorise several books in one GPT request. Raises ValueError if the response doesn't cover every book."""
+    summaries_text = "\n".join(f'<summary book_id="{book_id}">{summary}</summary>' for book_id, summary in summaries.items())
+
+    response = await get_openai_client().beta.chat.completions.parse(
+        model="gpt-5.2",
+        messages=get_static_prompt()[0] + [{"role": "user", "content": f"{batch_note}\n\n{summaries_text}"}],
+        response_format={"type": "json_schema", "json_schema": _build_batch_response_schema(summaries)},
+        prompt_cache_key="book_categories"
+    )
+    record_openai_usage("categories", "gpt-5.2", response.usage)
+
+    if not response.choices or not response.choices[0].message.content:
+        raise ValueError(f"Empty response from OpenAI for books {list(summaries)}")
+
+    result = json.loads(response.choices[0].message.content)
+    categories = {book_id: result.get(str(book_id)) for book_id in summaries}
+    if missing := [book_id for book_id, chosen in categories.items() if not chosen]:
+        raise ValueError(f"No categories returned for books {missing}")
+    return categories
+
+
+async def get_categories_batch_async(summaries):
+    """Assigns several books to categories in as few GPT requests as possible.
+
+    Takes {book_id: summary} and returns ({book_id: categories}, {book_id: exception}) for books that failed.
+    """
+    categories, errors = {}, {}
+    chunks = [dict(list(summaries.items())[i:i + CATEGORY_BATCH_SIZE]) for i in range(0, len(summaries), CATEGORY_BATCH_SIZE)]
+
+    async def categorise(chunk):
+        if len(chunk) == 1:
+            book_id, summary = next(iter(chunk.items()))
+            try:
+                categories[book_id] = await get_categories_async(book_id, summary)
+            except Exception as e:
+                errors[book_id] = e
+            return
+        try:
+            categories.update(await _categorise_batch(chunk))
+        except Exception:
+            # Split the batch and retry both halves
+            items = list(chunk.items())
+            middle = len(items) // 2
+            await asyncio.gather(categorise(dict(items[:middle])), categorise(dict(items[middle:])))
+
+    await asyncio.gather(*(categorise(chunk) for chunk in chunks))
+    return categories, errors
+
+
+def get_categories_batch(summaries):
+    """Assigns several books to categories in as few GPT requests as possible."""
+    return run_sync(get_categories_batch_async(summaries))
+
+
+class CategoryBatcher:
+    """Collects the summaries of books that are processed concurrently and categorises them in batches.
+
+    A batch is sent as soon as batch_size summaries are waiting, or max_wait seconds after the first one arrived.
+    """
+
+    def __init__(self, batch_size=CATEGORY_BATCH_SIZE, max_wait=10):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._pending = {}
+        self._timer = None
+        self._running = set()
+
+    async def get_categories(self, book_id, summary):
+        """Queue a book for the next batch and wait for its categories."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[book_id] = (summary, future)
+
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        if pending:
+            task = asyncio.ensure_future(self._categorise(pending))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _categorise(self, pending):
+        try:
+            categories, errors = await get_categories_batch_async({book_id: summary for book_id, (summary, _) in pending.items()})
+        except Exception as e:
+            categories, errors = {}, {book_id: e for book_id in pending}
+
+        for book_id, (_, future) in pending.items():
+            if book_id in categories:
+                future.set_result(categories[book_id])
+            else:
+                future.set_exception(errors.get(book_id, ValueError(f"No categories returned for book {book_id}")))
+
+
+def remember_categories(book_id, category_ids):
+    """Remember the categories of a book and the version of categories.txt they were chosen from."""
+    execute(
+        "insert or replace into category_assignments (book_id, version, category_ids) values (?, ?, ?)",
+        (book_id, load_categories_version()[0], json.dumps([str(category_id) for category_id in category_ids]))
+    )
+
+
 def save_categories_sql(book_id, categories, output_file):
-    """Writes SQL INSERT statements for book-category mappings to output file."""
+    """Writes SQL INSERT statements for book-category mappings to output file (a path or a LineBuffer)."""
+    name_to_id, _, _ = load_categories()
     category_ids = [name_to_id[name] for name in categories]
 
-    with open(output_file, "a") as f:
-        for category_id in category_ids:
-            f.write(f"insert into mn_books_bookshelves (fk_books,fk_bookshelves) values ({book_id},{category_id});\n")
\ No newline at end of file
+    append_lines(output_file, [
+        f"insert into mn_books_bookshelves (fk_books,fk_bookshelves) values ({book_id},{category_id});" for category_id in category_ids
+    ])
+    after_write(output_file, remember_categories, book_id, category_ids)
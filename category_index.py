@@ -0,0 +1,295 @@
+# Fast category pre-ranking based on embeddings.
+# We have a few thousand books that were already categorised (the mn_books_bookshelves inserts in "results/" and
+# "processed_results/categories/"). Their summaries are embedded once and kept in a local index, together with
+# an embedding of each category name.
+# For a new book we embed its summary and look at the most similar already categorised books (k nearest neighbours).
+# If they agree clearly on the categories, we take those categories directly without asking GPT.
+# Otherwise we still ask GPT, but only offer it the categories that the neighbours and the category names suggest.
+# The index is built with "python category_index.py" and only new books get embedded on later runs.
+# "python category_index.py --evaluate 300" classifies 300 indexed books as if they were new (leaving each book out of
+# its own neighbours) and compares the categories taken on the fast path with the ones they actually have, to check
+# ACCEPT_SCORE and REJECT_SCORE. Categories that are no longer in categories.txt are never proposed.
+
+import argparse
+import base64
+import glob
+import json
+import os
+import random
+import re
+from array import array
+from utils import get_openai_client, run_sync
+from categories import load_categories, get_categories_async
+
+INDEX_FILE = "cache/category_index.json"
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 256
+EMBEDDING_BATCH_SIZE = 100
+
+# Classifier settings
+NEIGHBOURS = 15
+MIN_NEIGHBOUR_SIMILARITY = 0.6  # below this the closest known book is too different to trust the neighbours
+ACCEPT_SCORE = 0.6  # categories shared by at least this (similarity weighted) share of neighbours are proposed
+REJECT_SCORE = 0.2  # scores between REJECT_SCORE and ACCEPT_SCORE count as undecided and send the book to GPT
+MAX_CANDIDATES = 25
+DESCRIPTION_CANDIDATES = 10  # categories whose names are closest to the summary are always offered to GPT
+
+def _unescape_summary(sql_text):
+    """Turn the summary text of a results insert back into the original summary."""
+    return sql_text.replace("''", "'").replace(" (This is an automatically generated summary.)", "")
+
+
+def _month_result_files():
+    """Return results/update_MM_YY.txt files, oldest month first."""
+    return sorted(glob.glob("results/update_*.txt"), key=lambda path: path[-9:-4].split("_")[::-1])
+
+
+def load_historical_category_ids():
+    """Return {book_id: [category ids]} from all stored results, the most recent assignment of each book."""
+    category_ids = {}
+
+    # Later files win, the redo_categories files are the most recent assignment for the books they contain
+    for path in _month_result_files() + sorted(glob.glob("results/redo_categories*.txt")):
+        file_categories = {}
+        with open(path) as f:
+            for line in f:
+                if match := re.match(r"insert into mn_books_bookshelves \(fk_books,fk_bookshelves\) values \((\d+),(\d+)\);$", line.strip()):
+                    file_categories.setdefault(int(match.group(1)), []).append(match.group(2))
+        category_ids.update(file_categories)
+
+    for path in glob.glob("processed_results/categories/*.jsonl"):
+        processed = {}
+        with open(path) as f:
+            for line in f:
+                for book_id, category_id in json.loads(line).items():
+                    processed.setdefault(int(book_id), []).append(str(category_id))
+        for book_id, ids in processed.items():
+            category_ids.setdefault(book_id, ids)
+
+    return category_ids
+
+
+def load_historical_results():
+    """Return ({book_id: summary}, {book_id: [category names]}) from all stored results."""
+    summaries = {}
+    id_to_name = {cat_id: name for name, cat_id in load_categories()[0].items()}
+
+    for path in _month_result_files():
+        with open(path) as f:
+            for line in f:
+                if match := re.match(r"insert into attributes \(fk_books,fk_attriblist,text,nonfiling\) values \((\d+),520,'(.*)',0\);$", line.strip()):
+                    summaries[int(match.group(1))] = _unescape_summary(match.group(2))
+
+    for path in glob.glob("processed_results/summaries/*.jsonl"):
+        with open(path) as f:
+            for line in f:
+                for book_id, summary in json.loads(line).items():
+                    summaries.setdefault(int(book_id), _unescape_summary(summary))
+
+    categories = {}
+    for book_id, ids in load_historical_category_ids().items():
+        if names := [id_to_name[category_id] for category_id in ids if category_id in id_to_name]:
+            categories[book_id] = names
+    return summaries, categories
+
+
+def _encode_vector(vector):
+    return base64.b64encode(array('f', vector).tobytes()).decode()
+
+
+def _decode_vector(encoded):
+    vector = array('f')
+    vector.frombytes(base64.b64decode(encoded))
+    return vector
+
+
+def _normalise(vector):
+    norm = sum(x * x for x in vector) ** 0.5 or 1.0
+    return [x / norm for x in vector]
+
+
+def _similarity(a, b):
+    """Cosine similarity of two normalised vectors."""
+    return sum(x * y for x, y in zip(a, b))
+
+
+async def embed_texts_async(texts):
+    """Return normalised embeddings for texts."""
+    vectors = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        response = await get_openai_client().embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=texts[i:i + EMBEDDING_BATCH_SIZE],
+            dimensions=EMBEDDING_DIMENSIONS
+        )
+        vectors.extend(_normalise(item.embedding) for item in response.data)
+    return vectors
+
+
+class CategoryIndex:
+    """Embeddings of already categorised books and of the category names."""
+
+    def __init__(self, books=None, category_vectors=None):
+        self.books = books or {}  # book_id -> (categories, vector)
+        self.category_vectors = category_vectors or {}  # category name -> vector
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        """Load the index from disk, or return an empty index if it hasn't been built yet."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('model') != EMBEDDING_MODEL or data.get('dimensions') != EMBEDDING_DIMENSIONS:
+            return cls()
+        books = {int(book_id): (book['categories'], _decode_vector(book['vector'])) for book_id, book in data['books'].items()}
+        category_vectors = {name: _decode_vector(vector) for name, vector in data['category_vectors'].items()}
+        return cls(books, category_vectors)
+
+    def save(self, path=INDEX_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = {
+            'model': EMBEDDING_MODEL,
+            'dimensions': EMBEDDING_DIMENSIONS,
+            'category_vectors': {name: _encode_vector(vector) for name, vector in self.category_vectors.items()},
+            'books': {str(book_id): {'categories': cats, 'vector': _encode_vector(vector)} for book_id, (cats, vector) in self.books.items()}
+        }
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    async def update_async(self, summaries, categories):
+        """Embed category names and all categorised books that aren't in the index yet."""
+        if missing_names := [name for name in load_categories()[1] if name not in self.category_vectors]:
+            vectors = await embed_texts_async([f"Books in the category: {name}" for name in missing_names])
+            self.category_vectors.update(zip(missing_names, vectors))
+
+        # Categories may have been reassigned since a book was indexed
+        for book_id, (_, vector) in list(self.books.items()):
+            if book_id in categories:
+                self.books[book_id] = (categories[book_id], vector)
+
+        new_ids = [book_id for book_id in categories if book_id in summaries and book_id not in self.books]
+        vectors = await embed_texts_async([summaries[book_id] for book_id in new_ids])
+        for book_id, vector in zip(new_ids, vectors):
+            self.books[book_id] = (categories[book_id], vector)
+        return len(new_ids)
+
+    def rank(self, summary_vector, exclude_book_id=None):
+        """Return (category scores from the nearest neighbours, similarity of the closest neighbour)."""
+        neighbours = sorted(
+            ((_similarity(summary_vector, vector), cats) for book_id, (cats, vector) in self.books.items() if book_id != exclude_book_id),
+            key=lambda neighbour: neighbour[0],
+            reverse=True
+        )[:NEIGHBOURS]
+        if not neighbours:
+            return {}, 0.0
+
+        total = sum(max(similarity, 0.0) for similarity, _ in neighbours) or 1.0
+        current = set(load_categories()[1])
+        scores = {}
+        for similarity, cats in neighbours:
+            # Neighbours may have been categorised with categories that have since been removed or renamed
+            for name in cats:
+                if name in current:
+                    scores[name] = scores.get(name, 0.0) + max(similarity, 0.0) / total
+        return scores, neighbours[0][0]
+
+    def closest_category_names(self, summary_vector, count=DESCRIPTION_CANDIDATES):
+        """Return the count current category names closest to a summary."""
+        names = [name for name in load_categories()[1] if name in self.category_vectors]
+        return sorted(names, key=lambda name: -_similarity(summary_vector, self.category_vectors[name]))[:count]
+
+    def classify(self, summary_vector, exclude_book_id=None):
+        """Return (categories, None) when the neighbours agree clearly, otherwise (None, candidate categories for GPT)."""
+        scores, closest = self.rank(summary_vector, exclude_book_id)
+
+        accepted = [name for name, score in scores.items() if score >= ACCEPT_SCORE]
+        undecided = [name for name, score in scores.items() if REJECT_SCORE < score < ACCEPT_SCORE]
+        if accepted and not undecided and closest >= MIN_NEIGHBOUR_SIMILARITY:
+            return sorted(accepted, key=lambda name: -scores[name]), None
+
+        candidates = sorted(scores, key=lambda name: -scores[name])
+        candidates += [name for name in self.closest_category_names(summary_vector) if name not in candidates]
+        return None, candidates[:MAX_CANDIDATES]
+
+
+_index = None
+stats = {'fast': 0, 'escalated': 0}
+
+
+def get_index():
+    """Return the index loaded from disk (loaded once per run)."""
+    global _index
+    if _index is None:
+        _index = CategoryIndex.load()
+    return _index
+
+
+async def get_categories_fast_async(book_id, summary):
+    """Assigns book to categories from its nearest neighbours, falling back to GPT with a reduced candidate list."""
+    index = get_index()
+    if not index.books:
+        return await get_categories_async(book_id, summary)
+
+    [summary_vector] = await embed_texts_async([summary])
+    categories, candidates = index.classify(summary_vector, exclude_book_id=book_id)
+    if categories:
+        stats['fast'] += 1
+        return categories
+
+    stats['escalated'] += 1
+    return await get_categories_async(book_id, summary, candidates=candidates)
+
+
+def get_categories_fast(book_id, summary):
+    """Assigns book to categories from its nearest neighbours, falling back to GPT with a reduced candidate list."""
+    return run_sync(get_categories_fast_async(book_id, summary))
+
+
+def format_fast_categories_report():
+    """Return a one-line summary of how many books were categorised on the fast path and how many went to GPT."""
+    total = stats['fast'] + stats['escalated']
+    if not total:
+        return "Fast categories: no books categorised."
+    return f"Fast categories: {total} books, {stats['fast']} from their neighbours ({stats['fast'] / total:.0%}), {stats['escalated']} asked GPT"
+
+
+def evaluate(index, sample_size=300, seed=0):
+    """Classify sample_size indexed books leaving each out of its own neighbours, return a report of the fast path's accuracy."""
+    current = set(load_categories()[1])
+    book_ids = [book_id for book_id, (cats, _) in index.books.items() if current.intersection(cats)]
+    book_ids = random.Random(seed).sample(book_ids, min(sample_size, len(book_ids)))
+
+    fast, exact, true_positives, chosen, actual = 0, 0, 0, 0, 0
+    for book_id in book_ids:
+        cats, vector = index.books[book_id]
+        proposed, _ = index.classify(vector, exclude_book_id=book_id)
+        if not proposed:
+            continue
+        expected = current.intersection(cats)
+        fast += 1
+        exact += set(proposed) == expected
+        true_positives += len(expected.intersection(proposed))
+        chosen += len(proposed)
+        actual += len(expected)
+
+    if not fast:
+        return f"Evaluated {len(book_ids)} books: none would have been categorised on the fast path"
+    return (f"Evaluated {len(book_ids)} books: {fast} ({fast / len(book_ids):.0%}) on the fast path, {len(book_ids) - fast} escalated to GPT\n"
+            f"  Fast path: {exact / fast:.0%} exactly the stored categories, precision {true_positives / chosen:.0%}, "
+            f"recall {true_positives / actual:.0%} (ACCEPT_SCORE {ACCEPT_SCORE}, REJECT_SCORE {REJECT_SCORE})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the category index, or evaluate the fast path on it.")
+    parser.add_argument("--evaluate", type=int, metavar="BOOKS", help="Leave-one-out evaluation on this many indexed books")
+    args = parser.parse_args()
+
+    index = CategoryIndex.load()
+    if args.evaluate:
+        print(evaluate(index, args.evaluate))
+    else:
+        summaries, categories = load_historical_results()
+        added = run_sync(index.update_async(summaries, categories))
+        index.save()
+        print(f"Category index: {len(index.books)} books ({added} new), {len(index.category_vectors)} categories")
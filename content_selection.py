@@ -0,0 +1,170 @@
+# Selects the part of a book that we send to GPT for summarisation.
+# Many Gutenberg books start with pages that say little about the book itself: transcriber's notes,
+# "Produced by" lines, tables of contents, lists of illustrations, prefaces and dedications. We skip those
+# (never more than a fifth of the book) so the token budget is spent on the book's actual content. Books that fit
+# into the budget entirely are sent whole, front matter included, so a short prologue is never lost.
+# The budget is measured with the tokenizer of the model we're sending the text to. Some languages and scripts
+# (Finnish, Greek, Cyrillic, Chinese etc.) need many more tokens for the same amount of text, so they get a somewhat
+# larger budget. Optionally, part of the budget is spread over excerpts from later in the book.
+
+import re
+
+DEFAULT_TOKEN_BUDGET = 24000
+MAX_FRONT_MATTER_SHARE = 0.2
+MIN_PROSE_PARAGRAPH = 300  # characters - a paragraph this long is real text, not a heading or a list
+MAX_CHARS_PER_TOKEN = 8  # no language averages more characters per token, used to avoid encoding whole books
+
+# Token budget multiplier per language, roughly how many more tokens the same content needs compared to English
+LANGUAGE_TOKEN_FACTORS = {
+    'Finnish': 1.3, 'Hungarian': 1.3, 'Estonian': 1.3, 'Polish': 1.2, 'Czech': 1.2, 'Dutch': 1.1, 'German': 1.1,
+    'Greek': 1.5, 'Russian': 1.4, 'Ukrainian': 1.5, 'Bulgarian': 1.5, 'Serbian': 1.4,
+    'Chinese': 1.5, 'Japanese': 1.5, 'Korean': 1.5, 'Hebrew': 1.5, 'Arabic': 1.4, 'Tagalog': 1.2,
+}
+MAX_LANGUAGE_FACTOR = 1.5
+SAMPLE_SEPARATOR = "\n\n[...]\n\n"
+
+FRONT_MATTER_HEADINGS = [
+    "contents", "table of contents", "list of illustrations", "illustrations", "preface", "prefatory note",
+    "foreword", "introduction", "introductory note", "dedication", "transcriber's note", "transcriber's notes",
+    "note", "errata", "table des matières", "préface", "avant-propos", "inhalt", "inhaltsverzeichnis", "vorwort",
+    "einleitung", "índice", "indice", "prefacio", "prólogo", "prefazione", "inhoud", "voorwoord", "sisällys",
+    "esipuhe", "sisällysluettelo", "innehåll", "förord", "содержание", "предисловие", "περιεχόμενα", "πρόλογος",
+]
+FRONT_MATTER_PARAGRAPH = re.compile(
+    r"^\s*(\[?transcriber|produced by|e-?text prepared by|this e-?book was produced|\[illustration|\[frontispiece|"
+    r"copyright|all rights reserved|printed (in|by))",
+    re.IGNORECASE
+)
+CHAPTER_HEADING = re.compile(
+    r"^[ \t]*(chapter|chapitre|kapitel|capítulo|capitulo|capitolo|hoofdstuk|luku|kapitola|rozdział|глава|κεφάλαιο|"
+    r"book|livre|buch|libro|part|partie|teil|parte)[ \t]+(the[ \t]+)?([ivxlc]+|\d+|one|first|premier|erstes|primero|primo)\b"
+    r"|^[ \t]*第[一二三四五六七八九十百\d]+[章回]",
+    re.IGNORECASE | re.MULTILINE
+)
+
+_encodings = {}
+
+
+def get_encoding(model):
+    """Return the tiktoken encoding used by model (o200k_base for models tiktoken doesn't know yet)."""
+    if model not in _encodings:
+        import tiktoken
+
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+def token_budget_for(language, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Return the token budget for a book in the given language."""
+    return int(token_budget * min(LANGUAGE_TOKEN_FACTORS.get(language, 1.0), MAX_LANGUAGE_FACTOR))
+
+
+def _paragraph_spans(text, limit):
+    """Yield (start, end) of the complete blank-line separated paragraphs in text[:limit]."""
+    start = 0
+    for separator in re.compile(r"\n[ \t]*\r?\n").finditer(text, 0, limit):
+        if separator.start() > start:
+            yield start, separator.start()
+        start = separator.end()
+
+
+def _is_heading(paragraph):
+    """Whether a paragraph is a short all-caps heading."""
+    return len(paragraph.strip()) < 80 and paragraph.strip().isupper()
+
+
+def _is_front_matter(paragraph):
+    """Whether a paragraph at the start of the book is front matter (notes, headings, tables of contents)."""
+    heading = paragraph.strip().strip(".:").lower()
+    if heading in FRONT_MATTER_HEADINGS or FRONT_MATTER_PARAGRAPH.match(paragraph):
+        return True
+    # Tables of contents and lists: several short lines, many ending in page numbers or numerals
+    lines = [line.strip() for line in paragraph.strip().splitlines() if line.strip()]
+    if len(lines) >= 4 and sum(map(len, lines)) / len(lines) < 60:
+        numbered = sum(bool(re.search(r"(\d+|[ivxlc]+\.?)$", line, re.IGNORECASE)) for line in lines)
+        return numbered >= len(lines) / 2
+    return False
+
+
+def find_content_start(text):
+    """Return the offset where the book's actual content starts, skipping front matter."""
+    limit = int(len(text) * MAX_FRONT_MATTER_SHARE)
+
+    # A first chapter heading that is followed by real prose (not the same heading inside a table of contents)
+    for heading in CHAPTER_HEADING.finditer(text, 0, limit):
+        block_start = max(text.rfind("\n\n", 0, heading.start()), 0)
+        block_end = text.find("\n\n", heading.end())
+        if len(CHAPTER_HEADING.findall(text, block_start, block_end if block_end != -1 else limit)) > 1:
+            continue  # several headings in one block is a table of contents
+        next_heading = CHAPTER_HEADING.search(text, heading.end() + 1, heading.end() + 5000)
+        following = text[heading.end():next_heading.start() if next_heading else heading.end() + 5000]
+        if any(len(paragraph.strip()) >= MIN_PROSE_PARAGRAPH for paragraph in re.split(r"\n[ \t]*\r?\n", following)):
+            return text.rfind("\n", 0, heading.start()) + 1
+
+    # Otherwise skip front matter paragraphs at the very top. The text under a front matter heading (e.g. a preface)
+    # is only skipped once we find the heading that ends it.
+    start = 0
+    in_front_matter_section = False
+    for paragraph_start, paragraph_end in _paragraph_spans(text, limit):
+        paragraph = text[paragraph_start:paragraph_end]
+        if in_front_matter_section:
+            if not _is_heading(paragraph):
+                continue
+            start = paragraph_start
+            in_front_matter_section = False
+
+        if _is_front_matter(paragraph):
+            start = paragraph_end
+            in_front_matter_section = paragraph.strip().strip(".:").lower() in FRONT_MATTER_HEADINGS
+        else:
+            break
+    return start
+
+
+def first_tokens(text, token_budget, encoding):
+    """Return (the first token_budget tokens of text, whether that's the entire text), encoding only what's needed."""
+    prefix_length = token_budget * MAX_CHARS_PER_TOKEN
+    while True:
+        tokens = encoding.encode(text[:prefix_length], disallowed_special=())
+        if len(tokens) > token_budget:
+            return encoding.decode(tokens[:token_budget]), False
+        if prefix_length >= len(text):
+            return text, True
+        prefix_length *= 2
+
+
+def select_excerpt(text, language=None, model="gpt-5.2", token_budget=DEFAULT_TOKEN_BUDGET, sample_parts=1):
+    """Return (excerpt, is_entire_book) - the text to summarise, at most token_budget tokens (adjusted for language).
+
+    With sample_parts > 1 and a book that doesn't fit, half of the budget goes to the opening and the other half
+    is split between excerpts from sample_parts - 1 evenly spaced later positions, separated by "[...]".
+    """
+    encoding = get_encoding(model)
+    budget = token_budget_for(language, token_budget)
+
+    # Longer texts can't fit, no need to encode them
+    if len(text) <= budget * MAX_CHARS_PER_TOKEN:
+        excerpt, is_entire_book = first_tokens(text.strip(), budget, encoding)
+        if is_entire_book:
+            return excerpt, True
+
+    content = text[find_content_start(text):].strip()
+
+    excerpt, is_entire_book = first_tokens(content, budget, encoding)
+    if is_entire_book or sample_parts <= 1:
+        return excerpt, is_entire_book
+
+    opening, _ = first_tokens(content, budget // 2, encoding)
+    part_budget = (budget - budget // 2) // (sample_parts - 1)
+    excerpts = [opening]
+    for part in range(1, sample_parts):
+        position = len(opening) + (len(content) - len(opening)) * part // sample_parts
+        # Start at a paragraph boundary
+        paragraph_start = content.find("\n\n", position)
+        position = paragraph_start + 2 if paragraph_start != -1 else position
+        part_excerpt, _ = first_tokens(content[position:], part_budget, encoding)
+        excerpts.append(part_excerpt.strip())
+    return SAMPLE_SEPARATOR.join(excerpts), False
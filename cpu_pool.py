@@ -0,0 +1,74 @@
+# Runs the CPU-bound work of the pipeline in a pool of worker processes.
+# Finding the Gutenberg header and footer, parsing the book page, encoding a book with tiktoken to select the
+# summary excerpt and the readability score hold the GIL for up to seconds per big book, during which no other book
+# in the same process makes progress. Parsing author pages, the homepage and catalogue RDF files is quicker but also
+# goes through the pool. With "python main.py --processes 4" these run in 4 worker processes instead,
+# so the event loop and the fetch threads keep going and throughput scales with the cores.
+# The book text isn't pickled to the worker: it's copied once into a shared memory block that the worker reads,
+# and only the (small) result comes back. Without --processes everything runs in the calling thread as before.
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+_pool = None
+
+
+def start(processes):
+    """Start the worker pool (call before any work is submitted)."""
+    global _pool
+    # Forking a process with running threads (fetches, the sqlite lock) can leave locks held in the child, spawn is safe
+    _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+
+
+def shutdown():
+    """Stop the worker pool."""
+    global _pool
+    if _pool:
+        _pool.shutdown()
+        _pool = None
+
+
+def _run_on_shared(function, name, size, as_text, args):
+    """Worker side: call function with the data in shared memory block name (as str if as_text, else bytes) and args."""
+    block = shared_memory.SharedMemory(name=name)
+    data = block.buf[:size]
+    try:
+        return function(str(data, 'utf-8') if as_text else bytes(data), *args)
+    finally:
+        data.release()
+        block.close()
+
+
+def _share(data):
+    """Copy str or bytes into a new shared memory block, return (block, size, as_text)."""
+    as_text = isinstance(data, str)
+    raw = data.encode('utf-8') if as_text else data
+    block = shared_memory.SharedMemory(create=True, size=max(len(raw), 1))
+    block.buf[:len(raw)] = raw
+    return block, len(raw), as_text
+
+
+def call(function, data, *args):
+    """Return function(data, *args), computed in the worker pool if it's running. data is str or bytes."""
+    if _pool is None:
+        return function(data, *args)
+    block, size, as_text = _share(data)
+    try:
+        return _pool.submit(_run_on_shared, function, block.name, size, as_text, args).result()
+    finally:
+        block.close()
+        block.unlink()
+
+
+async def call_async(function, data, *args):
+    """Like call(), but waits for the worker without blocking the event loop."""
+    if _pool is None:
+        return function(data, *args)
+    block, size, as_text = _share(data)
+    try:
+        return await asyncio.wrap_future(_pool.submit(_run_on_shared, function, block.name, size, as_text, args))
+    finally:
+        block.close()
+        block.unlink()
@@ -0,0 +1,134 @@
+# Structured progress events for long runs.
+# With "python main.py --events <target>" every book start/finish, step duration, error and rate limit response
+# is written as one JSON object per line, so runs can be watched and analysed while tuning --concurrency.
+# The target is "-" (stdout), "tcp:host:port" or "unix:/path/to/socket" (a listening socket), or a file path.
+# With "-" stdout only carries the events: everything else the run prints goes to stderr instead.
+# Rate limit headers of all API responses (Serper, OpenAI, Anthropic, Perplexity, Wikipedia) are tracked per host.
+# With --progress a line with books/minute and ETA is printed after each finished book.
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+# Headers in which providers report how much of their rate limit is left
+RATE_LIMIT_HEADERS = {
+    'remaining_requests': ["x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining", "x-ratelimit-remaining"],
+    'remaining_tokens': ["x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining"],
+    'retry_after': ["retry-after"],
+}
+
+_sink = None
+_lock = threading.Lock()
+_run_started = None
+
+stats = {'total': 0, 'queued': 0, 'running': 0, 'finished': 0, 'errors': 0, 'rate_limited': 0}
+rate_limits = {}  # host -> latest rate limit headers
+step_seconds = Counter()  # step -> seconds spent in it, summed over all books
+
+
+def configure(target):
+    """Send events to target: "-" for stdout, "tcp:host:port", "unix:/path" or a file path."""
+    global _sink
+    if target == "-":
+        # Keep the real stdout for the events and point file descriptor 1 at stderr, so that print() and the output
+        # of worker processes don't end up between the JSON lines
+        sys.stdout.flush()
+        _sink = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    elif target.startswith("tcp:"):
+        host, port = target[4:].rsplit(":", 1)
+        _sink = socket.create_connection((host, int(port))).makefile("w", encoding="utf-8")
+    elif target.startswith("unix:"):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(target[5:])
+        _sink = connection.makefile("w", encoding="utf-8")
+    else:
+        _sink = open(target, "a", encoding="utf-8")
+
+
+def emit(event, **fields):
+    """Write one event, if an event target is configured."""
+    global _sink
+    if _sink is None:
+        return
+    line = json.dumps({'time': round(time.time(), 3), 'event': event, **fields}, ensure_ascii=False)
+    with _lock:
+        try:
+            _sink.write(line + "\n")
+            _sink.flush()
+        except (OSError, ValueError):
+            _sink = None  # the listener went away, monitoring must never stop the run
+
+
+def run_started(total):
+    """Start the run clock for total books."""
+    global _run_started
+    _run_started = time.monotonic()
+    stats['total'] = total
+    emit("run_started", books=total)
+
+
+def book_queued(book_id):
+    """A book is waiting for a free slot."""
+    stats['queued'] += 1
+
+
+def book_started(book_id):
+    """A book's pipeline started."""
+    stats['queued'] -= 1
+    stats['running'] += 1
+    emit("book_started", book_id=book_id, queued=stats['queued'], running=stats['running'])
+
+
+def book_finished(book_id, seconds):
+    """A book's pipeline finished."""
+    stats['running'] -= 1
+    stats['finished'] += 1
+    emit("book_finished", book_id=book_id, seconds=round(seconds, 3), queued=stats['queued'], running=stats['running'],
+         finished=stats['finished'], books_per_minute=round(books_per_minute(), 2), rate_limits=rate_limits)
+
+
+def error(message):
+    """An error was logged."""
+    stats['errors'] += 1
+    emit("error", message=message)
+
+
+def step_finished(book_id, step, started):
+    """A pipeline step of a book finished, started is its time.monotonic() start time."""
+    seconds = time.monotonic() - started
+    step_seconds[step] += seconds
+    emit("step_finished", book_id=book_id, step=step, seconds=round(seconds, 3))
+
+
+async def record_response(response):
+    """httpx response hook: remember rate limit headers and report 429 responses."""
+    state = {key: response.headers[name] for key, names in RATE_LIMIT_HEADERS.items() for name in names if name in response.headers}
+    host = response.request.url.host
+    if state:
+        rate_limits[host] = state
+    if response.status_code == 429:
+        stats['rate_limited'] += 1
+        emit("rate_limited", host=host, **state)
+
+
+def books_per_minute():
+    """Books finished per minute since the run started."""
+    elapsed = time.monotonic() - _run_started if _run_started else 0
+    return stats['finished'] / (elapsed / 60) if elapsed else 0.0
+
+
+def format_progress():
+    """Return a one-line summary of the run's progress with throughput and ETA."""
+    rate = books_per_minute()
+    remaining = stats['total'] - stats['finished']
+    eta = f"{remaining / rate:.0f} min" if rate else "unknown"
+    line = (f"Progress: {stats['finished']}/{stats['total']} books ({stats['running']} running, {stats['queued']} waiting), "
+            f"{rate:.1f} books/min, ETA {eta}, {stats['errors']} errors")
+    if stats['rate_limited']:
+        line += f", {stats['rate_limited']} rate limited responses"
+    return line
@@ -0,0 +1,106 @@
+# Extracts what we need from gutenberg.org pages: the book page (title, language, authors), the homepage (latest
+# book id) and author pages (titles, existing Wikipedia link).
+# The pages are parsed with lxml (a C parser) instead of BeautifulSoup's pure Python html.parser, and the few
+# elements we need are picked out with XPath instead of walking the whole tree. The values returned are the same
+# as those of the BeautifulSoup versions (see benchmarks/parse_gutenberg_pages.py).
+
+import re
+
+HAS_CLASS = 'contains(concat(" ", normalize-space(@class), " "), " {} ")'
+AUTHOR_ROLES = ['Author', 'Editor', 'Translator', 'Contributor', 'Illustrator']
+LIFE_DATES = re.compile(r',\s*(\d{4}?-\d{4}?|\d{4}-|-\d{4})$')
+# lxml refuses str input with an XML declaration, which some (XHTML) pages start with
+XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+
+def parse_html(html):
+    """Return the lxml document of a page given as bytes or str."""
+    import lxml.html
+
+    if isinstance(html, bytes):
+        try:
+            html = html.decode('utf-8')
+        except UnicodeDecodeError:
+            pass  # let lxml use the page's declared encoding
+    if isinstance(html, str):
+        html = XML_DECLARATION.sub("", html, count=1)
+    return lxml.html.fromstring(html if html.strip() else "<html></html>")
+
+
+def _first(element, xpath):
+    matches = element.xpath(xpath)
+    return matches[0] if matches else None
+
+
+def parse_book_metadata(html):
+    """Return tuple: (title, language, authors) from the HTML of a book's page on gutenberg.org."""
+    metadata = {'title': None, 'language': None, 'authors': []}
+    document = parse_html(html)
+
+    # Extract title
+    content_div = _first(document, '//div[@id="content"]')
+    if content_div is not None and (title_tag := _first(content_div, './/h1')) is not None:
+        metadata['title'] = title_tag.text_content().strip()
+
+    bibrec_table = _first(document, f'//table[{HAS_CLASS.format("bibrec")}]')
+    if bibrec_table is None:
+        return metadata['title'], metadata['language'], metadata['authors']
+
+    # Extract language and authors
+    for row in bibrec_table.iter('tr'):
+        header_cell = _first(row, './/th')
+        if header_cell is None:
+            continue
+
+        role = header_cell.text_content().strip()
+        value_cell = _first(row, './/td')
+
+        # Extract language
+        if 'Language' in role:
+            if value_cell is not None:
+                metadata['language'] = value_cell.text_content().strip()
+
+        # Extract authors
+        elif role in AUTHOR_ROLES:
+            author_link = _first(value_cell, './/a[@href]') if value_cell is not None else None
+            if author_link is not None and '/ebooks/author/' in author_link.get('href'):
+                full_name = author_link.text_content().strip()
+                name = full_name
+                life_dates = ''
+
+                # Extract life dates from name (format: "Name, dates")
+                if date_match := LIFE_DATES.search(full_name):
+                    life_dates = date_match.group(1)
+                    name = full_name[:date_match.start()].strip()
+
+                metadata['authors'].append({
+                    'id': author_link.get('href').split('/')[-1],
+                    'name': name,
+                    'life_dates': life_dates,
+                    'role': role
+                })
+
+    return metadata['title'], metadata['language'], metadata['authors']
+
+
+def parse_latest_book_id(html):
+    """Return the id of the first book linked in the page content of the gutenberg.org homepage, or None."""
+    page_content = _first(parse_html(html), f'//div[{HAS_CLASS.format("page_content")}]')
+    if page_content is None:
+        return None
+
+    for link in page_content.iter('a'):
+        if match := re.search(r'/ebooks/(\d+)', link.get('href', '')):
+            return int(match.group(1))
+    return None
+
+
+def parse_author_page(html):
+    """Return {'book_titles', 'has_wiki_link'} from the HTML of an author's page on gutenberg.org."""
+    document = parse_html(html)
+    titles = [
+        _first(book, f'.//span[{HAS_CLASS.format("title")}]').text_content()
+        for book in document.xpath(f'//li[{HAS_CLASS.format("booklink")}]')
+    ]
+    has_wiki_link = any("wikipedia.org" in link.get("href", "") for link in document.iter("a"))
+    return {'book_titles': titles, 'has_wiki_link': has_wiki_link}
@@ -0,0 +1,126 @@
+# The previous implementations of functions that have since been replaced by faster versions.
+# They are kept so that the new versions can be checked against them: by the benchmarks in "benchmarks/" and
+# by "python main.py --shadow" (see shadow.py), which runs both on the real inputs of a run and reports differences.
+# When an optimisation replaces a function, move the old version here.
+
+import re
+
+
+def remove_gutenberg_wrapper(text):
+    """The line-based version remove_gutenberg_wrapper() used to be."""
+    lines = text.split('\n')
+    start_index = 0
+    end_index = len(lines)
+
+    for i, line in enumerate(lines):
+        if line.startswith("*** START OF"):
+            start_index = i + 1
+        elif line.startswith("*** END OF"):
+            end_index = i
+            break
+
+    return '\n'.join(lines[start_index:end_index]).strip()
+
+
+def book_text_from_bytes(content, encoding=None):
+    """What get_book_content() used to do with a download: decode all of it, then remove header and footer."""
+    return remove_gutenberg_wrapper(content.decode(encoding or 'utf-8', 'replace'))
+
+
+def parse_book_metadata(html):
+    """The BeautifulSoup version get_book_metadata() used to parse book pages with."""
+    from bs4 import BeautifulSoup
+
+    metadata = {'title': None, 'language': None, 'authors': []}
+    soup = BeautifulSoup(html, 'html.parser')
+
+    content_div = soup.find('div', id='content')
+    if content_div and (title_tag := content_div.find('h1')):
+        metadata['title'] = title_tag.text.strip()
+
+    bibrec_table = soup.find('table', class_='bibrec')
+    if not bibrec_table:
+        return metadata['title'], metadata['language'], metadata['authors']
+
+    author_roles = ['Author', 'Editor', 'Translator', 'Contributor', 'Illustrator']
+    for row in bibrec_table.find_all('tr'):
+        header_cell = row.find('th')
+        if not header_cell:
+            continue
+
+        role = header_cell.text.strip()
+
+        if 'Language' in role:
+            if value_cell := row.find('td'):
+                metadata['language'] = value_cell.text.strip()
+
+        elif role in author_roles:
+            value_cell = row.find('td')
+            if value_cell and (author_link := value_cell.find('a', href=True)) and '/ebooks/author/' in author_link['href']:
+                author_id = author_link['href'].split('/')[-1]
+                full_name = author_link.text.strip()
+                name = full_name
+                life_dates = ''
+
+                if date_match := re.search(r',\s*(\d{4}?-\d{4}?|\d{4}-|-\d{4})$', full_name):
+                    life_dates = date_match.group(1)
+                    name = full_name[:date_match.start()].strip()
+
+                metadata['authors'].append({
+                    'id': author_id,
+                    'name': name,
+                    'life_dates': life_dates,
+                    'role': role
+                })
+
+    return metadata['title'], metadata['language'], metadata['authors']
+
+
+def parse_author_page(html):
+    """The BeautifulSoup version get_author_metadata() used to parse author pages with."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    titles = [book.find("span", class_="title").text for book in soup.find_all("li", class_="booklink")]
+    has_wiki_link = any("wikipedia.org" in (link.get("href", "")) for link in soup.find_all("a"))
+    return {'book_titles': titles, 'has_wiki_link': has_wiki_link}
+
+
+def parse_latest_book_id(html):
+    """The BeautifulSoup version get_latest_book_id() used to parse the homepage with."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    page_content = soup.find('div', class_='page_content')
+    if not page_content:
+        return None
+    for link in page_content.find_all('a'):
+        if match := re.search(r'/ebooks/(\d+)', link.get('href', '')):
+            return int(match.group(1))
+    return None
+
+
+def summary_text(book_content, chunk_size=24000):
+    """The text summarise_book() used to send to GPT: the entire book if it fits into chunk_size tokens, else its start."""
+    import tiktoken
+
+    encoding = tiktoken.get_encoding("cl100k_base")
+    tokens = encoding.encode(book_content)
+    if len(tokens) > chunk_size:
+        return encoding.decode(tokens[:chunk_size])
+    return book_content
+
+
+def truncate_to_words(text, word_limit):
+    """Truncate text to specified number of words."""
+    words = text.split()
+    if len(words) <= word_limit:
+        return text
+    return ' '.join(words[:word_limit])
+
+
+def calculate_readability_score(book_content):
+    """Calculate Flesch reading ease score for book content."""
+    import textstat
+
+    return textstat.flesch_reading_ease(book_content)
@@ -8,49 +8,90 @@
 # Results get saved in "results/", Errors in "errors/". Both in a file named after the current month.
 # Results are saved as SQL INSERT statements (as requested by Greg).
 
+import argparse
+import os
+import asyncio
 import time
 from datetime import datetime
 from utils import *
 from summaries import (
-    summarise_book,
+    summarise_book_async,
     save_summary_sql,
     format_summary
 )
-from wiki_based_summaries import generate_wiki_based_summary, exclude_short_articles, pick_longest_article
+from wiki_based_summaries import generate_wiki_based_summary_async, exclude_short_articles_async, pick_longest_article
 from readability import calculate_readability_score, save_readability_sql
-from wiki_for_books import get_book_wikipedia_links, save_book_wikis_sql
+from wiki_for_books import get_book_wikipedia_links_async, save_book_wikis_sql, format_validation_report
 from wiki_for_authors import (
-    get_author_metadata,
-    get_author_wikipedia_link,
+    get_author_metadata_async,
+    get_author_wikipedia_link_async,
     save_author_wiki_sql
 )
-from categories import get_categories, save_categories_sql
+from categories import get_categories_async, save_categories_sql, CategoryBatcher
+from category_index import get_categories_fast_async, format_fast_categories_report
+from siblings import fingerprint, get_wikipedia_links_with_siblings, get_author_lookup, remember_author_lookup
+from usage import format_usage_report
+import author_catalogue
+import cpu_pool
+import events
+import shadow
+from prefetch import Prefetcher, PREFETCH_DEPTH
+from budget import BudgetPlanner, FULL_PLAN
+from results_writer import ResultsWriter, after_write
+from profiling import SamplingProfiler, PROFILE_DIR
 
 STEP_DELAY = 1
-
-start_id = load_last_processed_id()
-end_id = get_latest_book_id()
-print(f"Processing books {start_id + 1} to {end_id}")
+AUTHOR_CONCURRENCY = 4  # lookups for the authors of one book that run at the same time
 
 month_year = datetime.now().strftime('%m_%y')
 results_file = f"results/update_{month_year}.txt"
 errors_file = f"errors/errors_{month_year}.txt"
 
-for book_id in range(start_id + 1, end_id + 1):
+# Set by --category-batch: categorises the summaries of concurrently processed books together
+category_batcher = None
+# Set by --sample-parts: long books are summarised from their opening plus excerpts from this many parts in total
+sample_parts = 1
+# Set by --map-reduce: long books are summarised from summaries of all their parts instead of only the opening
+map_reduce = False
+# Set by --fast-categories: takes categories from similar already categorised books when they agree clearly
+fast_categories = False
+# Set by --progress: prints books/minute and ETA after each finished book
+show_progress = False
+# Set by --profile / --profile-books: samples where CPU time goes in each step (see profiling.py)
+profiler = None
+# Set by --shadow: also runs the implementations that optimised code replaced and reports differences (see shadow.py)
+shadow_mode = False
+# Set by --budget-dollars / --deadline-minutes: picks a cheaper or faster plan per book when needed (see budget.py)
+planner = None
+# Set by run() unless --prefetch 0: fetches the next books in the background (see prefetch.py)
+prefetcher = None
+# Writes the results and errors of each book together once it's done (see results_writer.py), --fsync-every N syncs them
+writer = ResultsWriter()
+
+
+async def process_book(book_id):
+    """Run the five pipeline steps for one book and write its results and errors together at the end."""
+    book_results = writer.buffer(results_file)
+    book_errors = writer.buffer(errors_file)
     # Fetch all relevant data from Gutenberg once
     # @Rowan - IMPORTANT NOTE - The pipeline relies on the data as it's extracted in the code right below this comment. "title" for example is a scraping of the h1 tag of the page of the particular book, meaning it includes the book's title and also its author. "language" is obvious. "authors" and thus "author_str" also include translators, editors etc, but it's made obvious who the main author is! These details are very important for the various LLM layers within the pipeline to do their job well. The pipeline is tried and tested the exact way it is now. If you change the input data in any way, you'll need to carefully consider what adjustments will need to be made "downstream" to the pipeline itself.
 
     # Example 1: If you switch "title" to be the title from the db rather than the h1, Serper/Google will likely do a worse job since it isn't given the author. And if you give it author_str as a supplement, it may get confused because editors, translators etc are all included as well. (the h1 make a pretty good google search query).
-    
+
     # Example 2: generate_wiki_based_summary() ensures that a wiki-based summary uses that h1 tag as the name of the work within the summary. If you don't do that, there is a good chance that for some summaries there will be a discrepancy between the title in the h1 and the title in the summary - which is just awkward. I've seen that.
 
     # These are just two examples on top of my head.
 
     # Overall - be careful with changing the input data to the pipeline. If you change it, odds are that the pipeline itself will also need to be adjusted. That may or may not be worthwhile (at any rate, if would definitely need to be tested well).
 
-    book_content = get_book_content(book_id)
-    title, language, authors = get_book_metadata(book_id)
+    step_started = start_step(book_id, "fetch")
+    if prefetcher:
+        book_content, (title, language, authors) = await prefetcher.get(book_id)
+    else:
+        book_content, (title, language, authors) = await asyncio.to_thread(fetch_book, book_id)
+    events.step_finished(book_id, "fetch", step_started)
     authors_str = "; ".join([a['name'] for a in authors if a['role'] == 'Author']) if authors else ""
+    plan = planner.plan_book(book_id, len(book_content or "")) if planner else FULL_PLAN
 
 
     # Print book header
@@ -61,41 +102,57 @@ for book_id in range(start_id + 1, end_id + 1):
     print(f"\n{separator}")
     print(f"Book #{book_id}: {title_display}")
     print(f"Language: {language_display} | Authors: {authors_display}")
+    if planner:
+        print(f"Plan: {plan['name']}")
     print(f"{separator}\n")
 
 
+    step_started = start_step(book_id, "book_wikipedia")
     # Find Wikipedia link(s) for book
     if title and language and authors_str:
         try:
-            wiki_links = get_book_wikipedia_links(title, language, authors_str)
+            # Volumes of the same work and re-releases reuse the links found for their sibling
+            book_fingerprint = fingerprint(title, authors, book_content or "")
+            wiki_links, sibling_id = await get_wikipedia_links_with_siblings(
+                book_id,
+                book_fingerprint,
+                lambda: get_book_wikipedia_links_async(title, language, authors_str, plan['validation_tiers']),
+                book_results
+            )
             count = len(wiki_links)
             result = f"{count} validated" if count > 0 else "No match found"
+            if sibling_id:
+                result += f" (reused from #{sibling_id})"
             print(f"[Step 1/5] Book Wikipedia: {result}")
-            save_book_wikis_sql(book_id, wiki_links, results_file)
+            save_book_wikis_sql(book_id, wiki_links, book_results)
         except Exception as e:
             print("[Step 1/5] Book Wikipedia: Error")
-            log_error(f"{book_id}, Book wiki, {e}", errors_file)
+            log_error(f"{book_id}, Book wiki, {e}", book_errors)
             wiki_links = []
     else:
         print("[Step 1/5] Book Wikipedia: Skipped (missing data)")
         wiki_links = []
-    time.sleep(STEP_DELAY)
+    events.step_finished(book_id, "book_wikipedia", step_started)
+    await asyncio.sleep(STEP_DELAY)
 
 
+    step_started = start_step(book_id, "summary")
     # Generate summary
     # Try to summarise using a Wikipedia article, if not possible fall back to book content method.
     if title:
         try:
             summary = None
             # New approach: summarise using a Wikipedia article
-            if wiki_links:
+            if wiki_links and plan['wiki_summary']:
                 try:
                     print("  Generating summary from Wikipedia...")
-                    valid_articles = exclude_short_articles(wiki_links)
+                    valid_articles = await exclude_short_articles_async(wiki_links)
                     article_text = pick_longest_article(valid_articles)
 
                     if article_text:
-                        summary = generate_wiki_based_summary(article_text, title)
+                        if shadow_mode:
+                            shadow.compare_truncation(book_id, article_text)
+                        summary = await generate_wiki_based_summary_async(article_text, title)
                         # Claude may decide that there's not enough information for a summary.
                         if "insufficient information" in summary.lower():
                             summary = None
@@ -107,75 +164,242 @@ for book_id in range(start_id + 1, end_id + 1):
 
             # Existing approach: summarise using book content
             if not summary and book_content:
-                summary = summarise_book(book_content, title)
+                if shadow_mode:
+                    await shadow.compare_summary_text(book_id, book_content, language, plan['summary_tokens'], sample_parts)
+                summary = await summarise_book_async(book_content, title, language, sample_parts, map_reduce, plan['summary_tokens'])
                 print(f"[Step 2/5] Summary: Generated from book content")
 
             if summary:
                 summary = format_summary(summary)
-                save_summary_sql(book_id, summary, results_file)
+                save_summary_sql(book_id, summary, book_results)
             else:
                 print("[Step 2/5] Summary: Could not generate")
         except Exception as e:
             print("[Step 2/5] Summary: Error")
-            log_error(f"{book_id}, Summary, {e}", errors_file)
+            log_error(f"{book_id}, Summary, {e}", book_errors)
             summary = None
     else:
         print("[Step 2/5] Summary: Skipped (missing data)")
         summary = None
-    time.sleep(STEP_DELAY)
+    events.step_finished(book_id, "summary", step_started)
+    await asyncio.sleep(STEP_DELAY)
 
 
+    step_started = start_step(book_id, "categories")
     # Generate categories
     if summary:
         try:
             print("  Assigning categories...")
-            categories = get_categories(book_id, summary)
+            if fast_categories:
+                categories = await get_categories_fast_async(book_id, summary)
+            elif category_batcher:
+                categories = await category_batcher.get_categories(book_id, summary)
+            else:
+                categories = await get_categories_async(book_id, summary)
             categories_str = ", ".join(categories)
             print(f"[Step 3/5] Categories: {categories_str}")
-            save_categories_sql(book_id, categories, results_file)
+            save_categories_sql(book_id, categories, book_results)
         except Exception as e:
             print("[Step 3/5] Categories: Error")
-            log_error(f"{book_id}, Categories, {e}", errors_file)
+            log_error(f"{book_id}, Categories, {e}", book_errors)
     else:
         print("[Step 3/5] Categories: Skipped (missing summary)")
-    time.sleep(STEP_DELAY)
+    events.step_finished(book_id, "categories", step_started)
+    await asyncio.sleep(STEP_DELAY)
 
 
+    step_started = start_step(book_id, "readability")
     # Calculate readability score
     if book_content:
         try:
             print("  Calculating readability...")
-            readability = calculate_readability_score(book_content)
+            if shadow_mode:
+                readability = await shadow.readability_score(book_id, book_content, plan['readability_sample'])
+            else:
+                readability = await cpu_pool.call_async(calculate_readability_score, book_content, plan['readability_sample'])
             print(f"[Step 4/5] Readability: {readability}")
-            save_readability_sql(book_id, readability, results_file)
+            save_readability_sql(book_id, readability, book_results)
         except Exception as e:
             print("[Step 4/5] Readability: Error")
-            log_error(f"{book_id}, Readability, {e}", errors_file)
+            log_error(f"{book_id}, Readability, {e}", book_errors)
     else:
         print("[Step 4/5] Readability: Skipped (missing data)")
-    time.sleep(STEP_DELAY)
+    events.step_finished(book_id, "readability", step_started)
+    await asyncio.sleep(STEP_DELAY)
 
 
+    step_started = start_step(book_id, "author_wikipedia")
     # Find Wikipedia links for authors
     if authors:
+        # The same person can be listed in several roles (e.g. author and translator), look them up once
+        unique_authors = {}
         for author in authors:
-            try:
-                author_id = author['id']
-                author_metadata = get_author_metadata(author_id)
-
-                if author_metadata and not author_metadata.get('has_wiki_link', False):
-                    wiki_link = get_author_wikipedia_link(author, author_metadata)
-                    if wiki_link:
-                        save_author_wiki_sql(author_id, wiki_link, results_file)
-                        print(f"[Step 5/5] Author Wikipedia: {wiki_link}")
-                    else:
-                        print("[Step 5/5] Author Wikipedia: Not found")
-                else:
-                    print("[Step 5/5] Author Wikipedia: Already has link")
-            except Exception as e:
-                log_error(f"{book_id}, Author wiki {author_id}, {e}", errors_file)
+            unique_authors.setdefault(author['id'], author)
+        unique_authors = list(unique_authors.values())
+        semaphore = asyncio.Semaphore(AUTHOR_CONCURRENCY)
+        results = await asyncio.gather(*(find_author_wiki(book_id, author, semaphore, book_results, book_errors) for author in unique_authors))
+
+        # Lookups finish in any order, results are written in the order the authors are listed
+        for author, (message, wiki_link) in zip(unique_authors, results):
+            if message:
+                print(f"[Step 5/5] Author Wikipedia: {message}")
+            if wiki_link:
+                save_author_wiki_sql(author['id'], wiki_link, book_results)
     else:
         print("[Step 5/5] Author Wikipedia: Skipped (no authors)")
-    time.sleep(STEP_DELAY)
+    events.step_finished(book_id, "author_wikipedia", step_started)
+    start_step(book_id, None)
+    # Before latest_id.txt can move past the book
+    writer.commit(book_results, book_errors)
+    await asyncio.sleep(STEP_DELAY)
+
+
+def fetch_book(book_id):
+    """Return (book_content, (title, language, authors)) of a book from gutenberg.org."""
+    if shadow_mode:
+        return shadow.fetch_book(book_id)
+    return get_book_content(book_id), get_book_metadata(book_id)
+
+
+def start_step(book_id, step):
+    """Tell the profiler (if any) which step is running and return the step's start time."""
+    if profiler:
+        profiler.set_step(book_id, step)
+    return time.monotonic()
+
+
+async def find_author_wiki(book_id, author, semaphore, results, errors):
+    """Return (status message, new Wikipedia link or None) for one author of a book."""
+    author_id = author['id']
+    async with semaphore:
+        try:
+            # Already searched for this author, e.g. for another volume of the same work
+            if get_author_lookup(author_id) is not None:
+                return "Already looked up", None
+
+            author_metadata = await get_author_metadata_async(author_id)
+
+            if author_metadata and not author_metadata.get('has_wiki_link', False):
+                wiki_link = await get_author_wikipedia_link_async(author, author_metadata)
+                # Stored with the book's results, so a rerun after a crash looks the author up again
+                after_write(results, remember_author_lookup, author_id, wiki_link)
+                return (wiki_link, wiki_link) if wiki_link else ("Not found", None)
+            return "Already has link", None
+        except Exception as e:
+            log_error(f"{book_id}, Author wiki {author_id}, {e}", errors)
+            return None, None
+
+
+async def run(start_id, end_id, concurrency, prefetch_depth=PREFETCH_DEPTH):
+    """Process books start_id+1 to end_id, keeping up to `concurrency` books in flight on one thread."""
+    global prefetcher
+    if added := await author_catalogue.update_async(end_id):
+        print(f"Author catalogue: added {added} books")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    finished = set()
+    next_unsaved_id = start_id + 1
+    events.run_started(end_id - start_id)
+    if prefetch_depth > 0:
+        # Books wait for the semaphore in order, so the books after the ones in flight are fetched ahead
+        prefetcher = Prefetcher(range(start_id + 1, end_id + 1), fetch_book, depth=prefetch_depth)
+
+    async def process(book_id):
+        nonlocal next_unsaved_id
+        events.book_queued(book_id)
+        async with semaphore:
+            events.book_started(book_id)
+            started = time.monotonic()
+            await process_book(book_id)
+            events.book_finished(book_id, time.monotonic() - started)
+        finished.add(book_id)
+        if show_progress:
+            print(events.format_progress())
+
+        # Books can finish out of order, so latest_id.txt only moves past books whose predecessors are all done
+        while next_unsaved_id in finished:
+            finished.remove(next_unsaved_id)
+            next_unsaved_id += 1
+        if next_unsaved_id - 1 > start_id:
+            save_last_processed_id(next_unsaved_id - 1)
+
+    await asyncio.gather(*(process(book_id) for book_id in range(start_id + 1, end_id + 1)))
+    if prefetcher:
+        print(f"\nPrefetch: {prefetcher.hits} of {end_id - start_id} books were already fetched when their turn came")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process all new Gutenberg books since the last run.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of books processed at the same time (default: 1, i.e. sequential)")
+    # The fast path asks GPT per book when it isn't confident, it can't be combined with batching
+    category_mode = parser.add_mutually_exclusive_group()
+    category_mode.add_argument("--category-batch", type=int, default=0, help="Categorise up to this many books per GPT request (only useful with --concurrency > 1)")
+    category_mode.add_argument("--fast-categories", action="store_true", help="Use the embedding index (see category_index.py) and only ask GPT when it isn't confident")
+    parser.add_argument("--sample-parts", type=int, default=1, help="Summarise long books from the opening plus excerpts of later parts (e.g. 3)")
+    parser.add_argument("--map-reduce", action="store_true", help="Summarise long books from summaries of all their parts (cheap model per part, cached)")
+    parser.add_argument("--events", help='Write progress events as JSON lines to "-" (stdout), "tcp:host:port", "unix:/path" or a file')
+    parser.add_argument("--progress", action="store_true", help="Print books/minute and ETA after each finished book")
+    parser.add_argument("--profile", action="store_true", help="Process books one at a time and write a CPU profile per step to profiles/")
+    parser.add_argument("--profile-books", type=int, nargs="+", help="Only process and profile these book ids (results go to profiles/)")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_DEPTH, help=f"Fetch this many upcoming books in the background (default: {PREFETCH_DEPTH}, 0 to disable)")
+    parser.add_argument("--processes", type=int, default=0, help="Run CPU-heavy work (text and page parsing, tokenising, readability) in this many worker processes")
+    parser.add_argument("--budget-dollars", type=float, help="Spend at most this much on LLM calls, choosing cheaper processing for some books if needed")
+    parser.add_argument("--deadline-minutes", type=float, help="Finish within this many minutes, choosing faster processing for some books if needed")
+    parser.add_argument("--fsync-every", type=int, default=0, help="Sync the results and errors files to disk after every N books (default: 0, never)")
+    parser.add_argument("--shadow", action="store_true", help="Also run the legacy implementations of optimised steps and write a divergence report to shadow/")
+    args = parser.parse_args()
+
+    fast_categories = args.fast_categories
+    sample_parts = args.sample_parts
+    map_reduce = args.map_reduce
+    show_progress = args.progress
+    shadow_mode = args.shadow
+    writer = ResultsWriter(fsync_every=args.fsync_every)
+    if args.events:
+        events.configure(args.events)
+
+    if args.category_batch > 1:
+        category_batcher = CategoryBatcher(batch_size=args.category_batch)
+
+    if args.profile or args.profile_books:
+        profiler = SamplingProfiler(book_ids=args.profile_books)
+        profiler.start()
+    elif args.processes > 0:
+        # The profiler only sees this process, so profiled runs do the CPU work here
+        cpu_pool.start(args.processes)
+
+    if args.profile_books:
+        # Profiling runs must not end up in the monthly results or move latest_id.txt
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        results_file = f"{PROFILE_DIR}/results.txt"
+        errors_file = f"{PROFILE_DIR}/errors.txt"
+        # Nor change what the monthly runs remember (looked up authors, fingerprints, category versions)
+        writer = ResultsWriter(fsync_every=args.fsync_every, remember=False)
+        print(f"Profiling books {', '.join(map(str, args.profile_books))}")
+        for book_id in args.profile_books:
+            asyncio.run(process_book(book_id))
+    else:
+        start_id = load_last_processed_id()
+        end_id = get_latest_book_id()
+        print(f"Processing books {start_id + 1} to {end_id}")
+        if args.budget_dollars or args.deadline_minutes:
+            max_seconds = args.deadline_minutes * 60 if args.deadline_minutes else None
+            planner = BudgetPlanner(end_id - start_id, args.budget_dollars, max_seconds, 1 if profiler else args.concurrency)
+
+        # Samples are attributed to one step at a time, so a profiled run is sequential and doesn't fetch in the background
+        asyncio.run(run(start_id, end_id, 1 if profiler else args.concurrency, 0 if profiler else args.prefetch))
 
-    save_last_processed_id(book_id)
\ No newline at end of file
+    writer.close()
+    cpu_pool.shutdown()
+    if profiler:
+        profiler.stop()
+        print(f"\n{profiler.write()}")
+    if shadow_mode:
+        print(f"\n{shadow.write_report()}")
+    if planner:
+        print(f"\n{planner.format_report()}")
+        planner.save_calibration()
+    print(f"\n{format_usage_report()}")
+    print(format_validation_report())
+    if fast_categories:
+        print(format_fast_categories_report())
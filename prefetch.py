@@ -0,0 +1,53 @@
+# Downloads the text and page of upcoming books while the current ones are processed.
+# Fetching a book from gutenberg.org takes a few seconds, after which the network to gutenberg.org is idle for the
+# minutes the API calls of the steps take. The Prefetcher starts the fetch of the next books in the queue in the
+# background (in threads, like the normal fetch), so for a sequential run the data of the next book is usually there
+# when it's needed. At most `depth` books are fetched ahead, and no further fetches are started while the fetched but
+# not yet used book texts add up to more than `max_chars` characters.
+
+import asyncio
+
+PREFETCH_DEPTH = 2
+PREFETCH_MAX_CHARS = 64_000_000
+
+
+class Prefetcher:
+    """Fetches the books of a run ahead of time, in order, with fetch(book_id) -> (book_content, metadata)."""
+
+    def __init__(self, book_ids, fetch, depth=PREFETCH_DEPTH, max_chars=PREFETCH_MAX_CHARS):
+        self.book_ids = list(book_ids)
+        self.fetch = fetch
+        self.depth = depth
+        self.max_chars = max_chars
+        self.buffered_chars = 0
+        self.tasks = {}
+        self.taken = set()
+        self._next = 0
+        self.hits = 0
+
+    def _fill(self):
+        while len(self.tasks) < self.depth and self.buffered_chars < self.max_chars and self._next < len(self.book_ids):
+            book_id = self.book_ids[self._next]
+            self._next += 1
+            if book_id not in self.taken:
+                self.tasks[book_id] = asyncio.ensure_future(self._fetch(book_id))
+
+    async def _fetch(self, book_id):
+        result = await asyncio.to_thread(self.fetch, book_id)
+        self.buffered_chars += len(result[0] or "")
+        return result
+
+    async def get(self, book_id):
+        """Return the fetched data of book_id, waiting for its fetch (or fetching it now if it wasn't started)."""
+        self.taken.add(book_id)
+        task = self.tasks.pop(book_id, None)
+        self._fill()
+        if task is None:
+            return await asyncio.to_thread(self.fetch, book_id)
+
+        if task.done():
+            self.hits += 1
+        result = await task
+        self.buffered_chars -= len(result[0] or "")
+        self._fill()
+        return result
@@ -0,0 +1,195 @@
+# Sampling profiler for the pipeline steps.
+# "python main.py --profile" processes books one at a time while a background thread samples the stacks of all
+# other threads (sys._current_frames) every few milliseconds. Samples are attributed to the step that is running,
+# time spent waiting for API responses (idle event loop and thread pool) is left out, so what remains is CPU time.
+# "--profile-books 123 456" only processes (and profiles) the given books, their results go to "profiles/".
+# For each step a collapsed-stack file (profiles/<step>.folded, one "frame;frame;frame count" line per stack) is
+# written, which flamegraph.pl or speedscope turn into a flame graph, plus profiles/report.txt with the top functions.
+#
+# "python profiling.py record 123 456" saves the raw text and page of these books to cache/books/ and
+# "python profiling.py" then profiles the CPU-bound parts of the steps on those files (and on the cached Wikipedia
+# articles) without any network access or API calls.
+
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+PROFILE_DIR = "profiles"
+FIXTURES_DIR = "cache/books"
+SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 100
+TOP_FUNCTIONS = 15
+
+# Innermost frames of threads that are only waiting (event loop waiting for responses, idle thread pool workers)
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker")}
+
+
+def _frame_name(frame):
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def collapse_stack(frame):
+    """Return the stack of frame as "outermost;...;innermost"."""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads and counts them per pipeline step."""
+
+    def __init__(self, book_ids=None, interval=SAMPLE_INTERVAL):
+        self.book_ids = set(book_ids or [])
+        self.interval = interval
+        self.samples = defaultdict(Counter)  # step -> Counter of collapsed stacks
+        self.step = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def set_step(self, book_id, step):
+        """Attribute the following samples to step (or to nothing if step is None or the book isn't profiled)."""
+        self.step = step if step and (not self.book_ids or book_id in self.book_ids) else None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if (step := self.step) is None:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                innermost = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if innermost not in IDLE_FRAMES:
+                    self.samples[step][collapse_stack(frame)] += 1
+
+    def write(self, directory=PROFILE_DIR):
+        """Write <step>.folded files and report.txt to directory and return the report."""
+        os.makedirs(directory, exist_ok=True)
+        for step, stacks in self.samples.items():
+            with open(os.path.join(directory, f"{step}.folded"), "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        report = self.format_report()
+        with open(os.path.join(directory, "report.txt"), "w") as f:
+            f.write(report + "\n")
+        return report
+
+    def format_report(self):
+        """Return the samples per step with the functions that used the most time, both own and including callees."""
+        if not self.samples:
+            return "No profile samples recorded."
+
+        total = sum(sum(stacks.values()) for stacks in self.samples.values())
+        lines = [f"CPU profile ({total} samples, one every {self.interval * 1000:.0f} ms):"]
+        for step, stacks in sorted(self.samples.items(), key=lambda item: -sum(item[1].values())):
+            step_total = sum(stacks.values())
+            own, inclusive = Counter(), Counter()
+            for stack, count in stacks.items():
+                frames = stack.split(";")
+                own[frames[-1]] += count
+                for name in set(frames):
+                    inclusive[name] += count
+
+            lines.append(f"\n{step}: {step_total} samples ({step_total / total:.0%}, ~{step_total * self.interval:.1f} s)")
+            lines.append("  own time:")
+            lines += [f"    {count / step_total:6.1%}  {name}" for name, count in own.most_common(TOP_FUNCTIONS)]
+            lines.append("  including callees:")
+            lines += [f"    {count / step_total:6.1%}  {name}" for name, count in inclusive.most_common(TOP_FUNCTIONS)]
+        return "\n".join(lines)
+
+
+def record_fixtures(book_ids, directory=FIXTURES_DIR):
+    """Save the raw text and the page of the given books for offline profiling."""
+    import requests
+
+    os.makedirs(directory, exist_ok=True)
+    headers = {'User-Agent': 'Mozilla/5.0 (compatible; GutenbergProfiling/1.0; +https://github.com)'}
+    for book_id in book_ids:
+        for url, path in [
+            (f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}.txt", f"pg{book_id}.txt"),
+            (f"https://www.gutenberg.org/ebooks/{book_id}", f"pg{book_id}.html"),
+        ]:
+            response = requests.get(url, headers=headers, timeout=30)
+            response.raise_for_status()
+            with open(os.path.join(directory, path), "wb") as f:
+                f.write(response.content)
+        print(f"Recorded book #{book_id}")
+
+
+def profile_offline(book_ids=None, directory=FIXTURES_DIR):
+    """Profile the CPU-bound work of each step on recorded books and cached Wikipedia articles."""
+    from cache import execute
+    from utils import book_text_from_bytes, parse_book_metadata, article_cache
+    from content_selection import select_excerpt
+    from readability import calculate_readability_score
+    from siblings import fingerprint
+    from wiki_based_summaries import truncate_to_words
+
+    paths = sorted(glob.glob(os.path.join(directory, "pg*.txt")))
+    if book_ids:
+        paths = [path for path in paths if int(os.path.basename(path)[2:-4]) in book_ids]
+    if not paths:
+        print(f"No recorded books in {directory}/, record some with: python profiling.py record <book ids>")
+        return
+
+    profiler = SamplingProfiler()
+    profiler.start()
+    started = time.monotonic()
+    for path in paths:
+        book_id = int(os.path.basename(path)[2:-4])
+        with open(path, "rb") as f:
+            raw = f.read()
+        html = None
+        if os.path.exists(path[:-4] + ".html"):
+            with open(path[:-4] + ".html", "rb") as f:
+                html = f.read()
+
+        profiler.set_step(book_id, "fetch")
+        book_content = book_text_from_bytes(raw)
+        title, language, authors = parse_book_metadata(html) if html else (None, None, [])
+
+        profiler.set_step(book_id, "book_wikipedia")
+        fingerprint(title or "", authors, book_content)
+
+        profiler.set_step(book_id, "summary")
+        try:
+            select_excerpt(book_content, language)
+        except Exception as e:
+            print(f"Skipping excerpt selection: {e}")  # tiktoken needs its encoding files
+
+        profiler.set_step(book_id, "readability")
+        calculate_readability_score(book_content)
+        profiler.set_step(book_id, None)
+
+    # Word counts and truncation of the Wikipedia articles in the local cache
+    profiler.set_step(None, "wiki_summary")
+    for (value,) in execute(f"select value from {article_cache.table}"):
+        article_text = json.loads(value)
+        len(article_text.split())
+        truncate_to_words(article_text, 1200)
+    profiler.set_step(None, None)
+
+    profiler.stop()
+    print(f"Profiled {len(paths)} books in {time.monotonic() - started:.1f} s\n")
+    print(profiler.write())
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["record"]:
+        record_fixtures([int(book_id) for book_id in sys.argv[2:]])
+    else:
+        profile_offline({int(book_id) for book_id in sys.argv[1:]})
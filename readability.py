@@ -1,10 +1,33 @@
 # Calculates readability scores of a book using the Flesch-Kincaid readability test.
 # The exact score is then used to assign the book to a readability grade.
+# When time is short (see budget.py) the score of a long book is calculated from evenly spaced excerpts instead.
 
-import textstat
+from results_writer import append_lines
 
-def calculate_readability_score(book_content):
-  """Calculate Flesch reading ease score for book content."""
+SAMPLE_EXCERPTS = 20
+
+
+def sample_text(book_content, max_chars):
+  """Return SAMPLE_EXCERPTS evenly spaced excerpts of whole sentences adding up to about max_chars."""
+  excerpt_chars = max_chars // SAMPLE_EXCERPTS
+  step = len(book_content) // SAMPLE_EXCERPTS
+  excerpts = []
+  for start in range(0, step * SAMPLE_EXCERPTS, step):
+    excerpt = book_content[start:start + excerpt_chars]
+    # Drop the partial sentences at both ends
+    first_end, last_end = excerpt.find(". "), excerpt.rfind(". ")
+    if 0 <= first_end < last_end:
+      excerpt = excerpt[first_end + 2:last_end + 1]
+    excerpts.append(excerpt)
+  return "\n\n".join(excerpts)
+
+
+def calculate_readability_score(book_content, sample_chars=None):
+  """Calculate Flesch reading ease score for book content (from a sample of about sample_chars if it's longer)."""
+  import textstat  # slow to import, only needed here
+
+  if sample_chars and len(book_content) > sample_chars:
+    book_content = sample_text(book_content, sample_chars)
   return textstat.flesch_reading_ease(book_content)
 
 
@@ -27,9 +50,12 @@ def get_readability_grade(score):
   return None, None
 
 
-def save_readability_sql(book_id, score, output_file):
-  """Generate and append readability SQL statement to output file."""
+def readability_sql(book_id, score):
+  """Return the readability SQL statement for a book."""
   grade, description = get_readability_grade(score)
-  sql = f"insert into attributes (fk_books,fk_attriblist,text,nonfiling) values ({book_id},908,'Reading ease score: {score:.1f} ({grade}). {description}',0);"
-  with open(output_file, "a") as f:
-    f.write(f"{sql}\n")
\ No newline at end of file
+  return f"insert into attributes (fk_books,fk_attriblist,text,nonfiling) values ({book_id},908,'Reading ease score: {score:.1f} ({grade}). {description}',0);"
+
+
+def save_readability_sql(book_id, score, output_file):
+  """Generate and append readability SQL statement to output file (a path or a LineBuffer)."""
+  append_lines(output_file, [readability_sql(book_id, score)])
\ No newline at end of file
@@ -0,0 +1,145 @@
+# Re-categorises already processed books after categories.txt has changed.
+# Every time a book's categories are saved, the version of categories.txt they were chosen from is remembered (see
+# categories.py). "python recategorise.py" compares each book's version with the current categories.txt and only
+# re-categorises the books whose categories could change:
+# - books in a category that was removed or renamed
+# - books for which an added category is among the closest category names to their summary (the same test
+#   --fast-categories uses to offer categories to GPT). Without a category index every book counts as affected.
+# Books categorised before versions were recorded count as categorised with the oldest known version; pass the
+# categories.txt they were actually categorised with to compare against that instead:
+#   python recategorise.py --since old_categories.txt
+# Summaries are taken from the stored results, nothing is summarised or downloaded again. Books are categorised in
+# batches (see get_categories_batch_async) and every finished batch is stored, so an interrupted run continues
+# where it stopped. For the books whose categories changed, results/redo_categories_<version>.txt gets a delete of
+# their old categories followed by inserts of the new ones.
+
+import argparse
+import asyncio
+import json
+from cache import execute
+from categories import (
+    get_categories_batch_async,
+    load_categories,
+    load_categories_version,
+    parse_categories,
+    remember_categories,
+    store_categories_version
+)
+from category_index import embed_texts_async, get_index, load_historical_category_ids, load_historical_results
+
+RECATEGORISE_BATCH_SIZE = 100  # books stored per batch, GPT requests are batched further by get_categories_batch_async
+
+
+def get_version_categories(version):
+    """Return {category id: name} of a stored version of categories.txt."""
+    rows = execute("select content from category_versions where version = ?", (version,))
+    return dict(parse_categories(rows[0][0])) if rows else {}
+
+
+def load_assignments(since_version=None):
+    """Return {book_id: (version, [category ids])} of all books, from the local database and the stored results."""
+    if since_version is None:
+        oldest = execute("select version from category_versions order by recorded limit 1")
+        since_version = oldest[0][0] if oldest else load_categories_version()[0]
+
+    assignments = {book_id: (since_version, ids) for book_id, ids in load_historical_category_ids().items()}
+    for book_id, version, category_ids in execute("select book_id, version, category_ids from category_assignments"):
+        assignments[book_id] = (version, json.loads(category_ids))
+    return assignments
+
+
+def diff_categories(old, new):
+    """Return (ids of removed or renamed categories, names of added or renamed categories) between two {id: name}."""
+    changed_ids = {category_id for category_id, name in old.items() if new.get(category_id) != name}
+    added_names = [name for category_id, name in new.items() if old.get(category_id) != name]
+    return changed_ids, added_names
+
+
+async def find_affected_books(assignments, current_version):
+    """Return the ids of the books whose categories could change with the current categories.txt."""
+    current = dict(parse_categories(load_categories_version()[1]))
+    index = get_index()
+    if index.books and (missing := [name for name in current.values() if name not in index.category_vectors]):
+        vectors = await embed_texts_async([f"Books in the category: {name}" for name in missing])
+        index.category_vectors.update(zip(missing, vectors))
+    affected = []
+
+    for version, books in _group_by_version(assignments, current_version).items():
+        changed_ids, added_names = diff_categories(get_version_categories(version), current)
+
+        for book_id, category_ids in books.items():
+            if changed_ids.intersection(category_ids):
+                affected.append(book_id)
+            elif added_names:
+                # Close category names are only known for indexed books, the others have to be asked
+                if book_id not in index.books:
+                    affected.append(book_id)
+                elif set(index.closest_category_names(index.books[book_id][1])).intersection(added_names):
+                    affected.append(book_id)
+    return sorted(affected)
+
+
+def _group_by_version(assignments, current_version):
+    """Return {version: {book_id: [category ids]}} of the books not categorised with the current version."""
+    groups = {}
+    for book_id, (version, category_ids) in assignments.items():
+        if version != current_version:
+            groups.setdefault(version, {})[book_id] = category_ids
+    return groups
+
+
+def write_changes(changes, output_file):
+    """Append a delete of the old categories and inserts of the new ones for each changed book."""
+    with open(output_file, "a") as f:
+        for book_id, category_ids in changes.items():
+            f.write(f"delete from mn_books_bookshelves where fk_books = {book_id};\n")
+            for category_id in category_ids:
+                f.write(f"insert into mn_books_bookshelves (fk_books,fk_bookshelves) values ({book_id},{category_id});\n")
+
+
+async def recategorise_async(since=None):
+    """Re-categorise the affected books. Returns (books re-categorised, books with changed categories, failed books)."""
+    current_version = load_categories_version()[0]
+    since_version = None
+    if since:
+        with open(since) as f:
+            # Stored as the oldest version, so later runs also use it for books without a recorded version
+            since_version = store_categories_version(f.read(), recorded=0)
+    assignments = load_assignments(since_version)
+    affected = await find_affected_books(assignments, current_version)
+
+    summaries, _ = load_historical_results()
+    without_summary = [book_id for book_id in affected if book_id not in summaries]
+    affected = [book_id for book_id in affected if book_id in summaries]
+    print(f"{len(affected)} books to re-categorise ({len(without_summary)} affected books have no stored summary)")
+
+    name_to_id = load_categories()[0]
+    output_file = f"results/redo_categories_{current_version}.txt"
+    changed, failed = 0, 0
+    for start in range(0, len(affected), RECATEGORISE_BATCH_SIZE):
+        batch = affected[start:start + RECATEGORISE_BATCH_SIZE]
+        categories, errors = await get_categories_batch_async({book_id: summaries[book_id] for book_id in batch})
+        failed += len(errors)
+
+        changes = {}
+        for book_id, names in categories.items():
+            category_ids = [name_to_id[name] for name in names]
+            if set(category_ids) != set(assignments[book_id][1]):
+                changes[book_id] = category_ids
+        # Output first: a book only counts as done once its change is written
+        write_changes(changes, output_file)
+        for book_id, names in categories.items():
+            remember_categories(book_id, [name_to_id[name] for name in names])
+        changed += len(changes)
+        print(f"  {start + len(batch)}/{len(affected)} books, {changed} changed, {failed} failed")
+
+    return len(affected) - failed, changed, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-categorise the books affected by changes to categories.txt.")
+    parser.add_argument("--since", help="The categories.txt that books without a recorded version were categorised with")
+    args = parser.parse_args()
+
+    done, changed, failed = asyncio.run(recategorise_async(args.since))
+    print(f"Re-categorised {done} books, {changed} with changed categories, {failed} failed (run again to retry)")
@@ -0,0 +1,101 @@
+# Writes the results and errors of a book together, once the book is done.
+# The save_..._sql functions and log_error take either a file path (the line is appended right away, as tests.py
+# uses them) or a LineBuffer. main.py gives every book a LineBuffer for the results file and one for the errors
+# file and commits them when the book is finished: all its lines are written with one write per file, under a lock
+# shared by all concurrently processed books. A run that is interrupted mid-book therefore never leaves part of a
+# book's inserts in the results file, and latest_id.txt doesn't move past a book before its lines are written.
+# What a book stores in the local database about itself (its categories, author lookups, fingerprint) is registered
+# with after_write() and only stored once its lines are written, so a rerun after a crash doesn't skip any of it.
+# A writer with remember=False drops these calls (profiling runs write elsewhere and must not change what the
+# monthly runs remember).
+# The files stay open for the whole run. With fsync_every=N the files are also fsynced after every N books, so at
+# most the last N books are lost if the machine (not just the process) goes down.
+
+import os
+import threading
+
+
+class LineBuffer:
+    """Lines for one file, collected until they are committed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = []
+        self.callbacks = []
+
+    def write(self, line):
+        self.lines.append(line)
+
+
+def append_lines(output, lines):
+    """Add lines to output, a LineBuffer or the path of a file to append them to right away."""
+    if isinstance(output, LineBuffer):
+        for line in lines:
+            output.write(line)
+        return
+    with open(output, "a") as f:
+        f.write("".join(f"{line}\n" for line in lines))
+
+
+def after_write(output, function, *args):
+    """Call function(*args) once output (a LineBuffer) is committed, or right away if output is a path or None."""
+    if isinstance(output, LineBuffer):
+        output.callbacks.append((function, args))
+    else:
+        function(*args)
+
+
+class ResultsWriter:
+    """Writes committed LineBuffers to their files, one write per file and commit."""
+
+    def __init__(self, fsync_every=0, remember=True):
+        self.fsync_every = fsync_every
+        self.remember = remember
+        self._files = {}
+        self._commits = 0
+        self._lock = threading.Lock()
+
+    def buffer(self, path):
+        """Return a new LineBuffer for path."""
+        return LineBuffer(path)
+
+    def commit(self, *buffers):
+        """Write the lines of buffers (a book's results and errors) to their files, then run their after_write calls."""
+        lines_by_path = {}
+        callbacks = []
+        for line_buffer in buffers:
+            lines_by_path.setdefault(line_buffer.path, []).extend(line_buffer.lines)
+            callbacks.extend(line_buffer.callbacks)
+            line_buffer.lines = []
+            line_buffer.callbacks = []
+
+        with self._lock:
+            for path, lines in lines_by_path.items():
+                if not lines:
+                    continue
+                if path not in self._files:
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                    self._files[path] = open(path, "a")
+                self._files[path].write("".join(f"{line}\n" for line in lines))
+                self._files[path].flush()
+
+            self._commits += 1
+            if self.fsync_every and self._commits % self.fsync_every == 0:
+                self._sync()
+
+        if self.remember:
+            for function, args in callbacks:
+                function(*args)
+
+    def _sync(self):
+        for f in self._files.values():
+            os.fsync(f.fileno())
+
+    def close(self):
+        """Close all files (syncing them first with fsync_every)."""
+        with self._lock:
+            if self.fsync_every:
+                self._sync()
+            for f in self._files.values():
+                f.close()
+            self._files = {}
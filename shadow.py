@@ -0,0 +1,184 @@
+# Shadow mode: checks optimised code paths against the implementations they replaced.
+# "python main.py --shadow" runs the pipeline as usual, but for every book the deterministic parts that were sped up
+# (header/footer stripping, parsing the book page, the text sent to GPT for a summary from the book content, the
+# readability score and its SQL line, truncating the Wikipedia article) also run with their previous implementation
+# from legacy.py on the same input. Both sides are timed and their outputs compared; the pipeline continues with the
+# new output, computed as in a normal run (with the book's plan, in the worker pool if there is one), so results are
+# the same as in a normal run. Readability scores may differ by READABILITY_TOLERANCE.
+# At the end shadow/report.txt lists per comparison how often the outputs diverged and the time each side took, and
+# shadow/divergences.jsonl has the details of every divergence (book, comparison, where the outputs differ).
+
+import json
+import os
+import time
+from collections import defaultdict
+import cpu_pool
+import legacy
+
+SHADOW_DIR = "shadow"
+READABILITY_TOLERANCE = 0.05
+CONTEXT_CHARS = 80  # characters shown around the first difference of two texts
+
+comparisons = defaultdict(lambda: {'count': 0, 'diverged': 0, 'new_seconds': 0.0, 'legacy_seconds': 0.0})
+divergences = []
+
+
+def _timed(function, args):
+    """Return (result or the exception raised, seconds)."""
+    started = time.perf_counter()
+    try:
+        result = function(*args)
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - started
+
+
+def describe_difference(new, old):
+    """Return a short description of where two outputs differ."""
+    if isinstance(new, str) and isinstance(old, str):
+        position = next((i for i, (a, b) in enumerate(zip(new, old)) if a != b), min(len(new), len(old)))
+        start = max(0, position - CONTEXT_CHARS // 2)
+        return {
+            'position': position,
+            'lengths': [len(new), len(old)],
+            'new': new[start:position + CONTEXT_CHARS // 2],
+            'legacy': old[start:position + CONTEXT_CHARS // 2],
+        }
+    return {'new': repr(new), 'legacy': repr(old)}
+
+
+async def _timed_async(coroutine):
+    """Return (result or the exception raised, seconds) of awaiting coroutine."""
+    started = time.perf_counter()
+    try:
+        result = await coroutine
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - started
+
+
+def compare(name, book_id, new_function, legacy_function, args, equal=None):
+    """Run both implementations on args, record timing and divergence and return both results (new, legacy)."""
+    new, new_seconds = _timed(new_function, args)
+    old, legacy_seconds = _timed(legacy_function, args)
+    return _record(name, book_id, new, new_seconds, old, legacy_seconds, equal)
+
+
+async def compare_async(name, book_id, new_function, legacy_function, data, new_args=(), legacy_args=(), equal=None):
+    """Like compare(), but both run on data through cpu_pool, each with its own further arguments."""
+    new, new_seconds = await _timed_async(cpu_pool.call_async(new_function, data, *new_args))
+    old, legacy_seconds = await _timed_async(cpu_pool.call_async(legacy_function, data, *legacy_args))
+    return _record(name, book_id, new, new_seconds, old, legacy_seconds, equal)
+
+
+def _record(name, book_id, new, new_seconds, old, legacy_seconds, equal):
+    """Record timing and divergence of a comparison, return (new, legacy) or raise the exception of the new side."""
+    stats = comparisons[name]
+    stats['count'] += 1
+    stats['new_seconds'] += new_seconds
+    stats['legacy_seconds'] += legacy_seconds
+    if isinstance(new, Exception) or isinstance(old, Exception):
+        same = type(new) is type(old)
+    else:
+        same = equal(new, old) if equal else new == old
+    if not same:
+        stats['diverged'] += 1
+        divergences.append({'book_id': book_id, 'comparison': name, **describe_difference(new, old)})
+
+    if isinstance(new, Exception):
+        raise new
+    return new, old
+
+
+def _scores_equal(new, old):
+    return abs(new - old) <= READABILITY_TOLERANCE
+
+
+def fetch_book(book_id):
+    """Download a book's text and page once, compare stripping and parsing, return (book_content, (title, language, authors))."""
+    import requests
+    from utils import book_text_from_bytes
+    from html_parsing import parse_book_metadata
+
+    headers = {'User-Agent': 'Mozilla/5.0 (compatible; GutenbergShadow/1.0; +https://github.com)'}
+    book_content = None
+    try:
+        response = requests.get(f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}.txt", headers=headers, timeout=10)
+        response.raise_for_status()
+        book_content, _ = compare("header stripping", book_id, book_text_from_bytes, legacy.book_text_from_bytes,
+                                  (response.content, response.encoding))
+    except requests.RequestException:
+        print("Error: Failed to fetch book content")
+
+    metadata = None, None, []
+    try:
+        response = requests.get(f"https://www.gutenberg.org/ebooks/{book_id}", headers=headers, timeout=10)
+        response.raise_for_status()
+        metadata, _ = compare("metadata parsing", book_id, parse_book_metadata, legacy.parse_book_metadata, (response.content,))
+    except requests.RequestException:
+        print("Error: Failed to fetch book metadata")
+    return book_content, metadata
+
+
+def _summary_text(book_content, language, chunk_size, sample_parts):
+    from content_selection import select_excerpt
+
+    return select_excerpt(book_content, language, "gpt-5.2", chunk_size, sample_parts)[0]
+
+
+async def compare_summary_text(book_id, book_content, language, chunk_size, sample_parts):
+    """Compare the text sent to GPT for a summary from the book content with what was sent before."""
+    try:
+        await compare_async("summary text", book_id, _summary_text, legacy.summary_text, book_content,
+                            (language, chunk_size, sample_parts), (chunk_size,))
+    except Exception as e:
+        print(f"Shadow: summary text failed ({e})")  # e.g. tiktoken without its encoding files
+
+
+async def readability_score(book_id, book_content, sample_chars=None):
+    """Calculate the readability score as a normal run does, compare it and its SQL line with the legacy ones."""
+    from readability import calculate_readability_score, readability_sql
+
+    score, legacy_score = await compare_async("readability score", book_id, calculate_readability_score,
+                                              legacy.calculate_readability_score, book_content, (sample_chars,),
+                                              equal=_scores_equal)
+    compare("readability SQL", book_id, lambda: readability_sql(book_id, score), lambda: readability_sql(book_id, legacy_score), ())
+    return score
+
+
+def compare_truncation(book_id, article_text, word_limit=1200):
+    """Compare the truncation of the Wikipedia article a summary is generated from."""
+    from wiki_based_summaries import truncate_to_words
+
+    compare("article truncation", book_id, truncate_to_words, legacy.truncate_to_words, (article_text, word_limit))
+
+
+def format_report():
+    """Return the divergences and timings of all comparisons."""
+    if not comparisons:
+        return "Shadow mode: nothing compared."
+
+    lines = ["Shadow mode (new vs legacy implementation):"]
+    for name, stats in comparisons.items():
+        new_ms = stats['new_seconds'] * 1000 / stats['count']
+        legacy_ms = stats['legacy_seconds'] * 1000 / stats['count']
+        speed_up = f"{stats['legacy_seconds'] / stats['new_seconds']:.1f}x" if stats['new_seconds'] else "-"
+        lines.append(
+            f"  {name}: {stats['diverged']} of {stats['count']} diverged, "
+            f"{new_ms:.2f} ms vs {legacy_ms:.2f} ms per call ({speed_up})"
+        )
+    if divergences:
+        lines.append(f"Details of {len(divergences)} divergences in {SHADOW_DIR}/divergences.jsonl")
+    return "\n".join(lines)
+
+
+def write_report(directory=SHADOW_DIR):
+    """Write report.txt and divergences.jsonl to directory and return the report."""
+    os.makedirs(directory, exist_ok=True)
+    report = format_report()
+    with open(os.path.join(directory, "report.txt"), "w") as f:
+        f.write(report + "\n")
+    with open(os.path.join(directory, "divergences.jsonl"), "w") as f:
+        for divergence in divergences:
+            f.write(json.dumps(divergence, ensure_ascii=False) + "\n")
+    return report
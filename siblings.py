@@ -0,0 +1,161 @@
+# Detects books that are volumes of the same work or re-releases of a book we already processed.
+# Gutenberg often publishes consecutive ids like "... Vol. 1 (of 3)", "... Vol. 2 (of 3)" etc. and they all have
+# the same Wikipedia article. Instead of paying for a Serper search plus Claude validations for each of them,
+# we reuse the Wikipedia links of the sibling that was processed first (in this run or in an earlier one).
+# Two books are siblings if they have the same authors and either the same title once volume markers are removed,
+# or near-identical opening pages (MinHash over word shingles of the beginning of the text).
+# Author lookups are also remembered per author id, so the other volumes don't search for the same author again.
+# Both are only stored once the book's results are written (see results_writer.py).
+
+import asyncio
+import hashlib
+import re
+from cache import DiskCache, define_table, execute
+from results_writer import after_write
+
+NUM_PERMUTATIONS = 64
+SHINGLE_SIZE = 5
+FINGERPRINT_CHARS = 20000  # roughly the opening pages
+MIN_TEXT_SIMILARITY = 0.8
+AUTHOR_NOT_FOUND_TTL = 180 * 24 * 3600  # authors without a Wikipedia link are searched again after half a year
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_permutations = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME)
+    for i in range(NUM_PERMUTATIONS)
+]
+
+# Only explicit volume words: words like "del" or "book" followed by a roman numeral are often part of the title
+# ("Storia del XIX secolo" and "Storia del XX secolo" are different works)
+VOLUME_PATTERNS = [
+    r"\(\s*(of|von|de|di)\s+\d+\s*\)",  # (of 3)
+    r"\b(vol|volume|tome|tomo|band|bd|teil|part|deel|osa)\.?\s*([ivxlc]+|\d+)\b",
+    r"\b\d+\s*(of|von)\s*\d+\b",
+]
+
+define_table("""create table if not exists book_fingerprints (
+    book_id integer primary key, authors_key text, title_key text, signature text, wiki_links text)""")
+define_table("create index if not exists book_fingerprints_authors on book_fingerprints (authors_key)")
+
+author_wiki_links = DiskCache("author_wiki_links")
+authors_not_found = DiskCache("authors_not_found", ttl=AUTHOR_NOT_FOUND_TTL)
+
+# Wikipedia searches that are currently running, by (authors_key, title_key), so siblings in the same run can wait for them
+_in_flight = {}
+
+
+def normalise_title(title):
+    """Lowercase title with volume/part markers and punctuation removed."""
+    title = title.lower()
+    for pattern in VOLUME_PATTERNS:
+        title = re.sub(pattern, " ", title)
+    title = re.sub(r"[^\w\s]", " ", title)
+    return " ".join(title.split())
+
+
+def minhash_signature(text):
+    """MinHash signature of the word shingles in the opening of the text."""
+    words = re.findall(r"\w+", text[:FINGERPRINT_CHARS].lower())
+    shingles = {
+        int.from_bytes(hashlib.blake2b(" ".join(words[i:i + SHINGLE_SIZE]).encode(), digest_size=8).digest(), "big")
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    }
+    return [min((a * shingle + b) % _MERSENNE_PRIME for shingle in shingles) for a, b in _permutations]
+
+
+def signature_similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    if not signature_a or not signature_b:
+        return 0.0
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / NUM_PERMUTATIONS
+
+
+def fingerprint(title, authors, book_content):
+    """Return the fingerprint used to find siblings of a book."""
+    author_ids = sorted(author['id'] for author in authors if author['role'] == 'Author')
+    return {
+        'authors_key': ",".join(author_ids),
+        'title_key': normalise_title(title),
+        'signature': minhash_signature(book_content) if book_content else None
+    }
+
+
+def find_sibling(book_id, book_fingerprint):
+    """Return (sibling_book_id, wiki_links) of an already processed sibling, or None."""
+    if not book_fingerprint['authors_key']:
+        return None
+
+    rows = execute(
+        "select book_id, title_key, signature, wiki_links from book_fingerprints where authors_key = ? and book_id != ? order by book_id",
+        (book_fingerprint['authors_key'], book_id)
+    )
+    for sibling_id, title_key, signature, wiki_links in rows:
+        same_title = title_key == book_fingerprint['title_key']
+        same_text = signature and signature_similarity(book_fingerprint['signature'], [int(x) for x in signature.split(",")]) >= MIN_TEXT_SIMILARITY
+        if same_title or same_text:
+            return sibling_id, wiki_links.split() if wiki_links else []
+    return None
+
+
+def remember_book(book_id, book_fingerprint, wiki_links):
+    """Store the fingerprint and Wikipedia links of a processed book."""
+    signature = ",".join(map(str, book_fingerprint['signature'])) if book_fingerprint['signature'] else None
+    execute(
+        "insert or replace into book_fingerprints (book_id, authors_key, title_key, signature, wiki_links) values (?, ?, ?, ?, ?)",
+        (book_id, book_fingerprint['authors_key'], book_fingerprint['title_key'], signature, " ".join(wiki_links))
+    )
+
+
+async def get_wikipedia_links_with_siblings(book_id, book_fingerprint, find_links, output=None):
+    """Return (wiki_links, sibling_book_id). Reuses a sibling's links, otherwise awaits find_links(). Remembered with output."""
+    group = (book_fingerprint['authors_key'], book_fingerprint['title_key'])
+
+    # A sibling from this run may still be searching, wait for its result instead of searching twice
+    if book_fingerprint['authors_key'] and group in _in_flight:
+        sibling_id, future = _in_flight[group]
+        try:
+            wiki_links = await asyncio.shield(future)
+            after_write(output, remember_book, book_id, book_fingerprint, wiki_links)
+            return wiki_links, sibling_id
+        except Exception:
+            pass
+
+    if sibling := find_sibling(book_id, book_fingerprint):
+        sibling_id, wiki_links = sibling
+        after_write(output, remember_book, book_id, book_fingerprint, wiki_links)
+        return wiki_links, sibling_id
+
+    future = asyncio.get_running_loop().create_future()
+    if book_fingerprint['authors_key']:
+        _in_flight[group] = (book_id, future)
+    try:
+        wiki_links = await find_links()
+        future.set_result(wiki_links)
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # siblings retry on their own, don't warn about an unretrieved exception
+        raise
+    finally:
+        if _in_flight.get(group, (None, None))[1] is future:
+            del _in_flight[group]
+
+    after_write(output, remember_book, book_id, book_fingerprint, wiki_links)
+    return wiki_links, None
+
+
+def get_author_lookup(author_id):
+    """Return the result of an earlier Wikipedia search for this author: a URL, "" for not found, or None if unknown."""
+    if wiki_link := author_wiki_links.get(author_id):
+        return wiki_link
+    if author_id in authors_not_found:
+        return ""
+    return None
+
+
+def remember_author_lookup(author_id, wiki_link):
+    """Remember the result of a Wikipedia search for an author."""
+    if wiki_link:
+        author_wiki_links.set(author_id, wiki_link)
+    else:
+        authors_not_found.set(author_id, True)
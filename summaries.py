@@ -1,6 +1,8 @@
 # Generates a summary of a book using ChatGPT.
 # For short books we feed in the entire book, for long books we feed in roughly the first 35 pages.
 # This is necessary due to cost and context-size limitations.
+# Front matter (tables of contents, transcriber's notes, prefaces) is skipped and the budget is adjusted for the
+# book's language, see content_selection.py.
 # Read the prompting for a better understanding of how it works.
 
 # One thing to realise is that what we're looking to put on the Gutenberg page is not
@@ -8,23 +10,35 @@
 # so that users can decide whether try a book or not. Kind of like a trailer to a movie.
 # In that sense "summary" is not actually a very accurate term.
 
-from openai import OpenAI
-import tiktoken
-import os
+# Optionally (map_reduce=True) long books are covered completely instead: the book is split into chunks that are
+# summarised in parallel by a cheaper model, then those partial summaries are turned into the usual two paragraphs.
+# Chunk summaries are cached in "cache/", so re-running the reduce step (e.g. after tweaking its prompt) is free.
+
+import asyncio
+import hashlib
 from dotenv import load_dotenv
+from utils import get_openai_client, run_sync
+from usage import record_openai_usage
+from content_selection import select_excerpt, find_content_start, get_encoding, SAMPLE_SEPARATOR
+from cache import DiskCache
+import cpu_pool
+from results_writer import append_lines
 
 load_dotenv()
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 
 def count_tokens(text, encoding_name='cl100k_base'):
     """Count the number of tokens in a text."""
+    import tiktoken
+
     encoding = tiktoken.get_encoding(encoding_name)
     return len(encoding.encode(text))
 
 
 def get_first_chunk(text, max_token_size, encoding_name="cl100k_base"):
     """Extract first chunk of text up to max_token_size tokens."""
+    import tiktoken
+
     encoding = tiktoken.get_encoding(encoding_name)
     tokens = encoding.encode(text)
     first_chunk_tokens = tokens[:max_token_size]
@@ -42,14 +56,14 @@ def format_summary(summary):
     return formatted
 
 
-def summarise_beginning_of_book(title_and_author, text):
-    """Generate two-paragraph summary from book's opening portion using GPT. To be used for long books."""
-    system_prompt = {"role": "system", "content": """You are a helpful assistant that is very good at deriving an understanding of books based on their opening chapters. You are also very good at writing texts about those books based on your understanding that are useful to potential readers who need to decide whether a particular book is interesting to them or not."""}
+# The instructions below are identical for every book. They come first in the request and the book-specific
+# parts (title and text) come last, so that OpenAI can serve the instructions from its prompt cache.
+BEGINNING_SYSTEM_PROMPT = """You are a helpful assistant that is very good at deriving an understanding of books based on their opening chapters. You are also very good at writing texts about those books based on your understanding that are useful to potential readers who need to decide whether a particular book is interesting to them or not."""
 
-    user_instruction = {"role": "user", "content": f"""You will be given the opening portion of a book. Read it very carefully to understand its content and derive an idea of the book in general. Based on your understanding write two paragraphs.
+BEGINNING_INSTRUCTION = """You will be given the opening portion of a book. Read it very carefully to understand its content and derive an idea of the book in general. Based on your understanding write two paragraphs.
 
   The first paragraph should be concise and to-the-point. The first sentence should include:
-  - the title of the book and name of the author (if provided), which is: {title_and_author}.
+  - the title of the book and name of the author (if provided), which I will give you right before the opening portion.
   - what type of book it is (e.g. novel, scientific publication, historical account, collection of short stories etc.)
   - what general time period the book was probably written in (e.g. early 19th century, mid-19th century, late 19th century, 14th century). Only refer to general time periods like that, do NOT use specific years and dates!
 
@@ -74,24 +88,18 @@ def summarise_beginning_of_book(title_and_author, text):
 
   In your writing use simple, clear, concise and expressive language.
   State the name of the book and the author's name only once throughout your response.
-  In some cases there may be a more appropriate word than "book" to refer to the work I'll give you. Use your judgement to use appropriate terminology. Always write in English. And never include any urls in your response."""}
-
-    assistant_reply = {"role": "assistant", "content": "Understood! Please provide the opening portion of the book and I will follow your instructions."}
-    book_content = {"role": "user", "content": f"START OF BOOK BEGINNING: \n{text}\nEND OF BOOK BEGINNING"}
+  In some cases there may be a more appropriate word than "book" to refer to the work I'll give you. Use your judgement to use appropriate terminology. Always write in English. And never include any urls in your response."""
 
-    messages = [system_prompt, user_instruction, assistant_reply, book_content]
-    response = openai_client.chat.completions.create(model="gpt-5.2", messages=messages)
-    return response.choices[0].message.content
+BEGINNING_ACKNOWLEDGMENT = "Understood! Please provide the opening portion of the book and I will follow your instructions."
 
+SAMPLED_EXCERPTS_NOTE = "\nNOTE: The opening portion is followed by a few shorter excerpts from later in the book (separated by [...]). Use them only to get a better idea of the book as a whole.\n"
 
-def summarise_entire_book(title_and_author, text):
-    """Generate two-paragraph summary from entire book using GPT. To be used for short books."""
-    system_prompt = {"role": "system", "content": """You are a helpful assistant that is very good at reading and understanding books. You are also very good at writing texts about those books based on your understanding that are useful to potential readers who need to decide whether a particular book is interesting to them or not."""}
+ENTIRE_SYSTEM_PROMPT = """You are a helpful assistant that is very good at reading and understanding books. You are also very good at writing texts about those books based on your understanding that are useful to potential readers who need to decide whether a particular book is interesting to them or not."""
 
-    user_instruction = {"role": "user", "content": f"""
+ENTIRE_INSTRUCTION = """
   You will be given the entire book. Read it very carefully to understand its content. Based on your understanding write two paragraphs.
 
-  In the first paragraph briefly lay out some high-level information about the book in general. Specifically include the title and the author (if available) of the book which is this: "{title_and_author}". Include it exactly like this, do NOT change it. Also include what type of book it is (e.g. novel, biography, crime fiction, scientific. publication, collection of short stories, historical account etc.) and what time period the book was probably written in (e.g. Victorian era, early 20th century etc.). Do NOT use specific years but instead use wider time spans. So for example, rather than saying "1886", you could say "late 1800s" or "in the late 19th century". Moreover include a very concise statement what the likely topic of the book is.
+  In the first paragraph briefly lay out some high-level information about the book in general. Specifically include the title and the author (if available) of the book, which I will give you right before the book. Include it exactly like that, do NOT change it. Also include what type of book it is (e.g. novel, biography, crime fiction, scientific. publication, collection of short stories, historical account etc.) and what time period the book was probably written in (e.g. Victorian era, early 20th century etc.). Do NOT use specific years but instead use wider time spans. So for example, rather than saying "1886", you could say "late 1800s" or "in the late 19th century". Moreover include a very concise statement what the likely topic of the book is.
 
   Here are some EXAMPLES of how that first paragraph should principally look like
   1) "Adventures of Sherlock Holmes" by Sir Arthur Conan Doyle is a collection of detective stories written during the late 19th century. The book follows the brilliant detective Sherlock Holmes and his companion Dr. John Watson as they solve various cases.
@@ -106,34 +114,146 @@ def summarise_entire_book(title_and_author, text):
   Overall this summary should be relatively brief.
 
   In your writing use simple, clear, concise and expressive language.
-  State the name of the book and the author's name only once throughout your response. Always write in English. And never include any urls in your response."""}
+  State the name of the book and the author's name only once throughout your response. Always write in English. And never include any urls in your response."""
+
+ENTIRE_ACKNOWLEDGMENT = "Understood! Please provide the book and I will follow your instructions."
+
+# Map-reduce mode
+MAP_MODEL = "gpt-5-mini"
+MAP_CHUNK_TOKENS = 12000
+MAP_CONCURRENCY = 8
+MAP_PROMPT_VERSION = 1  # increase when changing MAP_INSTRUCTION, so cached chunk summaries aren't reused
+
+MAP_SYSTEM_PROMPT = """You are a helpful assistant that is very good at reading books and summarising parts of them accurately."""
 
-    assistant_reply = {"role": "assistant", "content": "Understood! Please provide the book and I will follow your instructions."}
-    book_content = {"role": "user", "content": f"START OF BOOK: \n{text}\nEND OF BOOK"}
+MAP_INSTRUCTION = """You will be given one part of a book. Summarise this part in about 150 words. Cover the main characters, events, ideas and arguments that appear in it, in the order they appear. Only use information from the text you are given. Always write in English."""
 
-    messages = [system_prompt, user_instruction, assistant_reply, book_content]
-    response = openai_client.chat.completions.create(model="gpt-5.2", messages=messages)
+REDUCE_INSTRUCTION = ENTIRE_INSTRUCTION.replace(
+    "You will be given the entire book. Read it very carefully to understand its content.",
+    "You will be given summaries of all consecutive parts of the entire book, in order. Read them very carefully to understand the content of the book."
+)
+
+REDUCE_ACKNOWLEDGMENT = "Understood! Please provide the summaries of the parts of the book and I will follow your instructions."
+
+chunk_summaries = DiskCache("chunk_summaries")
+
+
+async def _create_summary(static_messages, book_message, prompt_cache_key):
+    """Send the static instructions followed by the book-specific message to GPT and return the response text."""
+    messages = static_messages + [book_message]
+    response = await get_openai_client().chat.completions.create(model="gpt-5.2", messages=messages, prompt_cache_key=prompt_cache_key)
+    record_openai_usage("summary", "gpt-5.2", response.usage)
     return response.choices[0].message.content
 
 
-def summarise_book(book_content, title):
-    """Generate summary for book, using full text or opening portion based on length."""
-    print("  Generating summary from book content...")
-    chunk_size = 24000
+async def summarise_beginning_of_book_async(title_and_author, text):
+    """Generate two-paragraph summary from book's opening portion using GPT. To be used for long books."""
+    static_messages = [
+        {"role": "system", "content": BEGINNING_SYSTEM_PROMPT},
+        {"role": "user", "content": BEGINNING_INSTRUCTION},
+        {"role": "assistant", "content": BEGINNING_ACKNOWLEDGMENT}
+    ]
+    note = SAMPLED_EXCERPTS_NOTE if SAMPLE_SEPARATOR in text else ""
+    book_content = {"role": "user", "content": f"TITLE AND AUTHOR: {title_and_author}\n{note}\nSTART OF BOOK BEGINNING: \n{text}\nEND OF BOOK BEGINNING"}
+    return await _create_summary(static_messages, book_content, "summary_beginning_of_book")
+
+
+def summarise_beginning_of_book(title_and_author, text):
+    """Generate two-paragraph summary from book's opening portion using GPT. To be used for long books."""
+    return run_sync(summarise_beginning_of_book_async(title_and_author, text))
+
+
+async def summarise_entire_book_async(title_and_author, text):
+    """Generate two-paragraph summary from entire book using GPT. To be used for short books."""
+    static_messages = [
+        {"role": "system", "content": ENTIRE_SYSTEM_PROMPT},
+        {"role": "user", "content": ENTIRE_INSTRUCTION},
+        {"role": "assistant", "content": ENTIRE_ACKNOWLEDGMENT}
+    ]
+    book_content = {"role": "user", "content": f"TITLE AND AUTHOR: {title_and_author}\n\nSTART OF BOOK: \n{text}\nEND OF BOOK"}
+    return await _create_summary(static_messages, book_content, "summary_entire_book")
+
+
+def summarise_entire_book(title_and_author, text):
+    """Generate two-paragraph summary from entire book using GPT. To be used for short books."""
+    return run_sync(summarise_entire_book_async(title_and_author, text))
+
+
+def split_into_chunks(text, chunk_tokens=MAP_CHUNK_TOKENS, model=MAP_MODEL):
+    """Split text into consecutive chunks of at most chunk_tokens tokens."""
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + chunk_tokens]) for i in range(0, len(tokens), chunk_tokens)]
+
+
+async def summarise_chunk_async(chunk, part, total_parts):
+    """Summarise one part of a book with the cheap model, using the cached summary if there is one."""
+    cache_key = hashlib.sha256(f"{MAP_MODEL}|{MAP_PROMPT_VERSION}|{part}/{total_parts}|{chunk}".encode()).hexdigest()
+    if summary := chunk_summaries.get(cache_key):
+        return summary
+
+    messages = [
+        {"role": "system", "content": MAP_SYSTEM_PROMPT},
+        {"role": "user", "content": MAP_INSTRUCTION},
+        {"role": "user", "content": f"PART {part} OF {total_parts}:\n{chunk}"}
+    ]
+    response = await get_openai_client().chat.completions.create(model=MAP_MODEL, messages=messages, prompt_cache_key="summary_map")
+    record_openai_usage("summary (map)", MAP_MODEL, response.usage)
+
+    summary = response.choices[0].message.content
+    chunk_summaries.set(cache_key, summary)
+    return summary
 
-    if count_tokens(book_content) > chunk_size:
-        beginning_of_book = get_first_chunk(book_content, chunk_size)
-        summary = summarise_beginning_of_book(title, beginning_of_book)
+
+async def summarise_book_map_reduce_async(title_and_author, book_content):
+    """Generate two-paragraph summary covering the whole book from summaries of all its parts."""
+    content = book_content[find_content_start(book_content):].strip()
+    chunks = split_into_chunks(content)
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+
+    async def summarise_part(part, chunk):
+        async with semaphore:
+            return await summarise_chunk_async(chunk, part, len(chunks))
+
+    print(f"  Summarising {len(chunks)} parts...")
+    part_summaries = await asyncio.gather(*(summarise_part(part, chunk) for part, chunk in enumerate(chunks, 1)))
+
+    static_messages = [
+        {"role": "system", "content": ENTIRE_SYSTEM_PROMPT},
+        {"role": "user", "content": REDUCE_INSTRUCTION},
+        {"role": "assistant", "content": REDUCE_ACKNOWLEDGMENT}
+    ]
+    parts_text = "\n\n".join(f"[Part {part} of {len(chunks)}]\n{summary}" for part, summary in enumerate(part_summaries, 1))
+    book_message = {"role": "user", "content": f"TITLE AND AUTHOR: {title_and_author}\n\nSTART OF PART SUMMARIES: \n{parts_text}\nEND OF PART SUMMARIES"}
+    return await _create_summary(static_messages, book_message, "summary_map_reduce")
+
+
+def summarise_book_map_reduce(title_and_author, book_content):
+    """Generate two-paragraph summary covering the whole book from summaries of all its parts."""
+    return run_sync(summarise_book_map_reduce_async(title_and_author, book_content))
+
+
+async def summarise_book_async(book_content, title, language=None, sample_parts=1, map_reduce=False, chunk_size=24000):
+    """Generate summary for book, using full text or opening portion (or all parts with map_reduce) based on length."""
+    print("  Generating summary from book content...")
+    text, is_entire_book = await cpu_pool.call_async(select_excerpt, book_content, language, "gpt-5.2", chunk_size, sample_parts)
+    if is_entire_book:
+        summary = await summarise_entire_book_async(title, text)
+    elif map_reduce:
+        summary = await summarise_book_map_reduce_async(title, book_content)
     else:
-        summary = summarise_entire_book(title, book_content)
+        summary = await summarise_beginning_of_book_async(title, text)
 
     return summary
 
 
+def summarise_book(book_content, title, language=None, sample_parts=1, map_reduce=False):
+    """Generate summary for book, using full text or opening portion (or all parts with map_reduce) based on length."""
+    return run_sync(summarise_book_async(book_content, title, language, sample_parts, map_reduce))
+
+
 def save_summary_sql(book_id, summary, output_file):
-    """Append SQL INSERT statement for book summary to output file."""
+    """Append SQL INSERT statement for book summary to output file (a path or a LineBuffer)."""
     note = " (This is an automatically generated summary.)"
     sql = f"insert into attributes (fk_books,fk_attriblist,text,nonfiling) values ({book_id},520,'{summary}{note}',0);"
-
-    with open(output_file, "a") as f:
-        f.write(f"{sql}\n")
+    append_lines(output_file, [sql])
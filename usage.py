@@ -0,0 +1,79 @@
+# Keeps track of the tokens used by all LLM calls of a run, per pipeline step and model.
+# The static parts of our prompts (instructions, examples, the category list) are placed at the very beginning
+# of every request so that OpenAI (automatic prefix caching) can serve them from its prompt cache. The Anthropic
+# prompts (validation, wiki-based summaries) are shorter than Anthropic's minimum cacheable prefix, so they aren't
+# cached. Cached input tokens are cheaper and faster, so we record how many we actually get.
+# With PRICES the recorded tokens are turned into dollars (used by the budget planner, see budget.py).
+
+from collections import defaultdict
+
+# USD per million tokens: (input, cached input, output). Anthropic cache writes are counted as normal input.
+PRICES = {
+    "gpt-5.2": (1.75, 0.175, 14.0),
+    "gpt-5-mini": (0.25, 0.025, 2.0),
+    "claude-haiku-4-5": (1.0, 0.1, 5.0),
+    "claude-sonnet-4-5": (3.0, 0.3, 15.0),
+    "claude-sonnet-4-5-20250929": (3.0, 0.3, 15.0),
+}
+
+_usage = defaultdict(lambda: {'calls': 0, 'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0})
+
+
+def record_openai_usage(step, model, usage):
+    """Record token usage of an OpenAI chat completion."""
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    totals = _usage[(step, model)]
+    totals['calls'] += 1
+    totals['input_tokens'] += usage.prompt_tokens or 0
+    totals['cached_tokens'] += (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+    totals['output_tokens'] += usage.completion_tokens or 0
+
+
+def record_anthropic_usage(step, model, usage):
+    """Record token usage of an Anthropic message. Anthropic reports cached and uncached input separately."""
+    if usage is None:
+        return
+    cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
+    cache_write = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+    totals = _usage[(step, model)]
+    totals['calls'] += 1
+    totals['input_tokens'] += (usage.input_tokens or 0) + cache_read + cache_write
+    totals['cached_tokens'] += cache_read
+    totals['output_tokens'] += usage.output_tokens or 0
+
+
+def get_usage():
+    """Return a copy of the recorded usage as {(step, model): totals}."""
+    return {key: dict(totals) for key, totals in _usage.items()}
+
+
+def cost_of(model, totals):
+    """Return the price in dollars of the tokens in totals (as recorded above), 0 for models without a price."""
+    input_price, cached_price, output_price = PRICES.get(model, (0, 0, 0))
+    uncached_tokens = totals['input_tokens'] - totals['cached_tokens']
+    return (uncached_tokens * input_price + totals['cached_tokens'] * cached_price + totals['output_tokens'] * output_price) / 1e6
+
+
+def get_cost_by_step():
+    """Return the dollars spent so far per step."""
+    costs = defaultdict(float)
+    for (step, model), totals in list(_usage.items()):
+        costs[step] += cost_of(model, totals)
+    return dict(costs)
+
+
+def format_usage_report():
+    """Return a human readable table of token usage and prompt cache hits per step."""
+    if not _usage:
+        return "No LLM calls made."
+
+    lines = ["Token usage (input tokens served from prompt cache in brackets):"]
+    for (step, model), totals in sorted(_usage.items()):
+        hit_rate = totals['cached_tokens'] / totals['input_tokens'] if totals['input_tokens'] else 0
+        lines.append(
+            f"  {step} ({model}): {totals['calls']} calls, {totals['input_tokens']} input "
+            f"({totals['cached_tokens']} cached, {hit_rate:.0%}), {totals['output_tokens']} output"
+        )
+    return "\n".join(lines)
@@ -1,32 +1,154 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import weakref
 import re
+import os
 from urllib.parse import unquote
 from dotenv import load_dotenv
+from cache import DiskCache
+from html_parsing import parse_book_metadata, parse_latest_book_id
+import cpu_pool
+from results_writer import append_lines
+import events
 
 load_dotenv()
 
 
+# Async helpers
+# Every provider call is implemented as a coroutine on top of the async SDK clients and httpx.
+# The synchronous functions are thin wrappers that run the coroutine with run_sync().
+# Clients are bound to the event loop they were created on, so we keep one set per running loop.
+# The SDKs and HTTP libraries are only imported when they're first needed (importing openai and anthropic alone takes
+# about a second), so scripts that don't call an API start quickly and don't need every API key.
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def get_loop_client(name, factory):
+    """Return the client called name for the running event loop, creating it with factory on first use."""
+    clients = _loop_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = factory()
+    return clients[name]
+
+
+def get_http_client():
+    """Return the shared async HTTP client for the running event loop."""
+    import httpx
+
+    return get_loop_client("http", lambda: httpx.AsyncClient(
+        timeout=30,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        event_hooks={'response': [events.record_response]}
+    ))
+
+
+def get_openai_client():
+    """Return the shared async OpenAI client for the running event loop."""
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    return get_loop_client("openai", lambda: AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=DefaultAsyncHttpxClient(event_hooks={'response': [events.record_response]})
+    ))
+
+
+def get_anthropic_client():
+    """Return the shared async Anthropic client for the running event loop."""
+    import anthropic
+
+    return get_loop_client("anthropic", lambda: anthropic.AsyncAnthropic(
+        api_key=os.getenv("ANTHROPIC_API_KEY"),
+        http_client=anthropic.DefaultAsyncHttpxClient(event_hooks={'response': [events.record_response]})
+    ))
+
+
+def run_sync(coroutine):
+    """Run a coroutine to completion from synchronous code."""
+    return asyncio.run(coroutine)
+
+
 # Text processing helpers
+# Lines that mark where the actual book starts and ends in Gutenberg texts. Next to the current
+# "*** START OF THE PROJECT GUTENBERG EBOOK ..." / "*** END OF ..." lines this covers the older formats
+# ("***START OF THIS PROJECT GUTENBERG EBOOK", "*END*THE SMALL PRINT! ...", "End of the Project Gutenberg EBook of ...").
+START_MARKERS = [
+    r"\*\*\* ?START OF",
+    r"\*+ ?START OF (THE|THIS) PROJECT GUTENBERG",
+    r"\*+ ?END\*? ?THE SMALL PRINT",
+]
+END_MARKERS = [
+    r"\*\*\* ?END OF",
+    r"\*+ ?END OF (THE|THIS) PROJECT GUTENBERG",
+    r"(?i:end of (the )?project gutenberg)",
+]
+
+
+def _compile_markers(markers, as_bytes=False):
+    """Compile (pattern for a marker line after a newline, pattern for a marker line at the very beginning).
+
+    Searching for a literal newline first is much faster than a MULTILINE "^", which re tries at every position.
+    A match ends before the newline that ends the line, which may be the newline in front of the next marker line.
+    """
+    alternatives = "|".join(f"(?:{marker})" for marker in markers)
+    patterns = (f"\\n(?:{alternatives})[^\\n]*", f"(?:{alternatives})[^\\n]*")
+    return tuple(re.compile(pattern.encode() if as_bytes else pattern) for pattern in patterns)
+
+
+_marker_patterns = {
+    str: (_compile_markers(START_MARKERS), _compile_markers(END_MARKERS)),
+    bytes: (_compile_markers(START_MARKERS, as_bytes=True), _compile_markers(END_MARKERS, as_bytes=True)),
+}
+_WHITESPACE_BYTES = frozenset(b" \t\n\r\x0b\x0c")
+
+
+def find_gutenberg_boundaries(text):
+    """Return (start, end) offsets of the book inside a Gutenberg text without copying it.
+
+    Works on str, bytes and memoryview. Like the original line-based version, the book starts after the last start
+    marker line before the first end marker line, and surrounding whitespace is excluded.
+    """
+    (start_line, start_first_line), (end_line, end_first_line) = _marker_patterns[str if isinstance(text, str) else bytes]
+    start, end = 0, len(text)
+
+    if end_first_line.match(text):
+        end = 0
+    elif end_match := end_line.search(text):
+        end = end_match.start() + 1
+
+    # The book starts on the line after the marker line
+    if start_match := start_first_line.match(text, 0, end):
+        start = start_match.end() + 1
+    for start_match in start_line.finditer(text, 0, end):
+        start = start_match.end() + 1
+    start = min(start, end)
+
+    # Exclude surrounding whitespace, as str.strip() would
+    is_space = str.isspace if isinstance(text, str) else _WHITESPACE_BYTES.__contains__
+    while start < end and is_space(text[start]):
+        start += 1
+    while end > start and is_space(text[end - 1]):
+        end -= 1
+    return start, end
+
+
 def remove_gutenberg_wrapper(text):
     """Remove Gutenberg header and footer from book text."""
-    lines = text.split('\n')
-    start_index = 0
-    end_index = len(lines)
+    start, end = find_gutenberg_boundaries(text)
+    return text[start:end]
 
-    for i, line in enumerate(lines):
-        if line.startswith("*** START OF"):
-            start_index = i + 1
-        elif line.startswith("*** END OF"):
-            end_index = i
-            break
 
-    return '\n'.join(lines[start_index:end_index]).strip()
+def book_text_from_bytes(content, encoding=None, boundaries=None):
+    """Return the book text of a raw Gutenberg .txt download, without header and footer."""
+    # Find the book inside the raw bytes (unless already done) and only decode that part
+    start, end = boundaries or find_gutenberg_boundaries(content)
+    return str(memoryview(content)[start:end], encoding or 'utf-8', 'replace').strip()
 
 
 # Gutenberg functions
 def get_latest_book_id():
     """Return the latest book ID from Project Gutenberg homepage."""
+    import requests
+
     try:
         response = requests.get(
             "https://www.gutenberg.org",
@@ -34,22 +156,15 @@ def get_latest_book_id():
             timeout=10
         )
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        page_content = soup.find('div', class_='page_content')
-
-        if not page_content:
-            return None
-
-        for link in page_content.find_all('a'):
-            if match := re.search(r'/ebooks/(\d+)', link.get('href', '')):
-                return int(match.group(1))
-        return None
+        return cpu_pool.call(parse_latest_book_id, response.content)
     except requests.RequestException:
         return None
 
 
 def get_book_content(book_id):
     """Return book text with Gutenberg header and footer removed."""
+    import requests
+
     url = f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}.txt"
     try:
         response = requests.get(
@@ -58,7 +173,8 @@ def get_book_content(book_id):
             timeout=10
         )
         response.raise_for_status()
-        return remove_gutenberg_wrapper(response.text)
+        boundaries = cpu_pool.call(find_gutenberg_boundaries, response.content)
+        return book_text_from_bytes(response.content, response.encoding, boundaries)
     except requests.RequestException:
         print("Error: Failed to fetch book content")
         return None
@@ -66,8 +182,9 @@ def get_book_content(book_id):
 
 def get_book_metadata(book_id):
     """Return tuple: (title, language, authors) for the given book."""
+    import requests
+
     url = f"https://www.gutenberg.org/ebooks/{book_id}"
-    metadata = {'title': None, 'language': None, 'authors': []}
 
     try:
         response = requests.get(
@@ -76,56 +193,10 @@ def get_book_metadata(book_id):
             timeout=10
         )
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Extract title
-        content_div = soup.find('div', id='content')
-        if content_div and (title_tag := content_div.find('h1')):
-            metadata['title'] = title_tag.text.strip()
-
-        bibrec_table = soup.find('table', class_='bibrec')
-        if not bibrec_table:
-            return metadata['title'], metadata['language'], metadata['authors']
-
-        # Extract language and authors
-        author_roles = ['Author', 'Editor', 'Translator', 'Contributor', 'Illustrator']
-        for row in bibrec_table.find_all('tr'):
-            header_cell = row.find('th')
-            if not header_cell:
-                continue
-
-            role = header_cell.text.strip()
-
-            # Extract language
-            if 'Language' in role:
-                if value_cell := row.find('td'):
-                    metadata['language'] = value_cell.text.strip()
-
-            # Extract authors
-            elif role in author_roles:
-                value_cell = row.find('td')
-                if value_cell and (author_link := value_cell.find('a', href=True)) and '/ebooks/author/' in author_link['href']:
-                    author_id = author_link['href'].split('/')[-1]
-                    full_name = author_link.text.strip()
-                    name = full_name
-                    life_dates = ''
-
-                    # Extract life dates from name (format: "Name, dates")
-                    if date_match := re.search(r',\s*(\d{4}?-\d{4}?|\d{4}-|-\d{4})$', full_name):
-                        life_dates = date_match.group(1)
-                        name = full_name[:date_match.start()].strip()
-
-                    metadata['authors'].append({
-                        'id': author_id,
-                        'name': name,
-                        'life_dates': life_dates,
-                        'role': role
-                    })
-
+        return cpu_pool.call(parse_book_metadata, response.content)
     except requests.RequestException:
         print("Error: Failed to fetch book metadata")
-
-    return metadata['title'], metadata['language'], metadata['authors']
+        return None, None, []
 
 
 # State management functions
@@ -142,25 +213,56 @@ def save_last_processed_id(book_id):
 
 
 def log_error(error_message, log_file):
-    """Append error message to the specified log file."""
-    with open(log_file, "a") as f:
-        f.write(f"{error_message}\n")
+    """Append error message to the specified log file (a path or a LineBuffer)."""
+    events.error(error_message)
+    append_lines(log_file, [error_message])
 
 
 # Wikipedia functions
-def download_wikipedia_article(url):
-    """Download Wikipedia article content from URL."""
+# Article texts are cached, so an article validated for one volume of a work isn't downloaded again for the next
+# volume, for the summary, or in a later run.
+# When at most EXTRACT_MAX_CHARS characters of an article are needed, only those are requested (the most the API
+# returns that way). Beyond that the whole article is downloaded in one request: asking for the introduction first
+# would need a second request for most articles, whose introduction is shorter than validation's 3000 characters.
+# The word count of an article can be looked up without downloading it at all (get_wikipedia_word_counts_async).
+ARTICLE_CACHE_TTL = 30 * 24 * 3600
+EXTRACT_MAX_CHARS = 1200
+article_cache = DiskCache("wikipedia_articles", ttl=ARTICLE_CACHE_TTL)
+langlink_cache = DiskCache("wikipedia_langlinks", ttl=ARTICLE_CACHE_TTL)
+word_count_cache = DiskCache("wikipedia_word_counts", ttl=ARTICLE_CACHE_TTL)
+WIKIPEDIA_HEADERS = {'User-Agent': 'WikiBookScraper/1.0 (Educational project)'}
+
+# Gutenberg language names and their Wikipedia language codes
+WIKIPEDIA_LANGUAGE_CODES = {
+    'English': 'en', 'French': 'fr', 'German': 'de', 'Dutch': 'nl', 'Italian': 'it', 'Spanish': 'es',
+    'Portuguese': 'pt', 'Finnish': 'fi', 'Swedish': 'sv', 'Danish': 'da', 'Norwegian': 'no', 'Icelandic': 'is',
+    'Hungarian': 'hu', 'Polish': 'pl', 'Czech': 'cs', 'Slovak': 'sk', 'Slovenian': 'sl', 'Croatian': 'hr',
+    'Serbian': 'sr', 'Bulgarian': 'bg', 'Romanian': 'ro', 'Russian': 'ru', 'Ukrainian': 'uk', 'Greek': 'el',
+    'Ancient Greek': 'el', 'Latin': 'la', 'Catalan': 'ca', 'Galician': 'gl', 'Basque': 'eu', 'Welsh': 'cy',
+    'Irish': 'ga', 'Scottish Gaelic': 'gd', 'Esperanto': 'eo', 'Estonian': 'et', 'Latvian': 'lv', 'Lithuanian': 'lt',
+    'Afrikaans': 'af', 'Tagalog': 'tl', 'Chinese': 'zh', 'Japanese': 'ja', 'Korean': 'ko', 'Hebrew': 'he',
+    'Arabic': 'ar', 'Persian': 'fa', 'Turkish': 'tr', 'Hindi': 'hi', 'Bengali': 'bn', 'Sanskrit': 'sa',
+    'Yiddish': 'yi', 'Occitan': 'oc', 'Frisian': 'fy', 'Breton': 'br', 'Friulian': 'fur', 'Interlingua': 'ia',
+}
+
+
+def parse_wikipedia_url(url):
+    """Return (language code, page title) of a Wikipedia article URL."""
     # Extract language code from URL
     lang_match = re.search(r'https?://([a-z]{2,3})\.wikipedia\.org', url)
     if not lang_match:
         raise ValueError(f"Could not extract language code from URL: {url}")
-    lang = lang_match.group(1)
 
     # Extract page title from URL
     title_match = re.search(r'/wiki/(.+)$', url.strip())
     if not title_match:
         raise ValueError(f"Could not extract page title from URL: {url}")
-    page_title = unquote(title_match.group(1))
+    return lang_match.group(1), unquote(title_match.group(1))
+
+
+async def _fetch_extract(url, extract_params):
+    """Return the plain text extract ("" if empty) of the article at url, limited by extract_params (see the TextExtracts API)."""
+    lang, page_title = parse_wikipedia_url(url)
 
     # Call Wikipedia API
     api_url = f"https://{lang}.wikipedia.org/w/api.php"
@@ -168,13 +270,13 @@ def download_wikipedia_article(url):
         'action': 'query',
         'format': 'json',
         'prop': 'extracts',
-        'explaintext': True,
+        'explaintext': 1,
         'redirects': 1,
-        'titles': page_title
+        'titles': page_title,
+        **extract_params
     }
-    headers = {'User-Agent': 'WikiBookScraper/1.0 (Educational project)'}
 
-    response = requests.get(api_url, params=params, headers=headers, timeout=30)
+    response = await get_http_client().get(api_url, params=params, headers=WIKIPEDIA_HEADERS, timeout=30)
     response.raise_for_status()
 
     data = response.json()
@@ -188,8 +290,107 @@ def download_wikipedia_article(url):
     if 'missing' in page:
         raise ValueError("Page does not exist")
 
-    content = page.get('extract', '')
+    return page.get('extract', '')
+
+
+async def download_wikipedia_article_async(url, max_chars=None):
+    """Download Wikipedia article content from URL (only about the first max_chars characters if given)."""
+    if content := article_cache.get(url):
+        return content[:max_chars]
+
+    # Only the beginning is needed: ask for at most max_chars characters
+    if max_chars and max_chars <= EXTRACT_MAX_CHARS:
+        cache_key = f"{url}#chars={max_chars}"
+        if (content := article_cache.get(cache_key)) is None:
+            content = await _fetch_extract(url, {'exchars': max_chars})
+            article_cache.set(cache_key, content)
+        # A shorter extract is the whole article. Some pages (e.g. without a lead section) return an empty extract.
+        if content:
+            return content[:max_chars]
+
+    content = await _fetch_extract(url, {})
     if not content:
         raise ValueError("Empty article content")
+    article_cache.set(url, content)
+    return content[:max_chars]
+
+
+def download_wikipedia_article(url, max_chars=None):
+    """Download Wikipedia article content from URL (only about the first max_chars characters if given)."""
+    return run_sync(download_wikipedia_article_async(url, max_chars))
+
+
+async def get_wikipedia_word_count_async(url):
+    """Return the word count of the article at url from Wikipedia's search index, or None if it isn't found."""
+    import httpx
+
+    if (word_count := word_count_cache.get(url)) is not None:
+        return word_count
+
+    lang, page_title = parse_wikipedia_url(url)
+    params = {
+        'action': 'query',
+        'format': 'json',
+        'list': 'search',
+        'srsearch': page_title.replace('_', ' '),
+        'srwhat': 'nearmatch',
+        'srprop': 'wordcount',
+        'srlimit': 1
+    }
+    try:
+        response = await get_http_client().get(f"https://{lang}.wikipedia.org/w/api.php", params=params, headers=WIKIPEDIA_HEADERS, timeout=30)
+        response.raise_for_status()
+        results = response.json().get('query', {}).get('search', [])
+    except httpx.HTTPError:
+        return None
+    if not results or 'wordcount' not in results[0]:
+        return None
+
+    word_count_cache.set(url, results[0]['wordcount'])
+    return results[0]['wordcount']
+
+
+async def get_wikipedia_word_counts_async(urls):
+    """Return {url: word count or None} for several articles."""
+    word_counts = await asyncio.gather(*(get_wikipedia_word_count_async(url) for url in urls))
+    return dict(zip(urls, word_counts))
+
+
+async def get_interlanguage_link_async(url, target_lang):
+    """Return the URL of the article in target_lang that the article at url links to (MediaWiki langlinks), or None."""
+    import httpx
+
+    cache_key = f"{target_lang}:{url}"
+    if (linked_url := langlink_cache.get(cache_key)) is not None:
+        return linked_url or None
+
+    lang, page_title = parse_wikipedia_url(url)
+    if lang == target_lang:
+        return url
+
+    params = {
+        'action': 'query',
+        'format': 'json',
+        'formatversion': 2,
+        'prop': 'langlinks',
+        'lllang': target_lang,
+        'llprop': 'url',
+        'redirects': 1,
+        'titles': page_title
+    }
+    try:
+        response = await get_http_client().get(f"https://{lang}.wikipedia.org/w/api.php", params=params, headers=WIKIPEDIA_HEADERS, timeout=30)
+        response.raise_for_status()
+        pages = response.json().get('query', {}).get('pages', [])
+    except httpx.HTTPError:
+        return None
+
+    langlinks = pages[0].get('langlinks', []) if pages else []
+    linked_url = langlinks[0].get('url') if langlinks else None
+    langlink_cache.set(cache_key, linked_url or "")
+    return linked_url
+
 
-    return content
\ No newline at end of file
+def get_interlanguage_link(url, target_lang):
+    """Return the URL of the article in target_lang that the article at url links to (MediaWiki langlinks), or None."""
+    return run_sync(get_interlanguage_link_async(url, target_lang))
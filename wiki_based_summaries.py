@@ -4,21 +4,19 @@
 # Claude generates 80-90 word teaser-style introduction based solely on Wikipedia content.
 # Returns "insufficient information" if article lacks enough detail for a meaningful summary.
 
-import anthropic
-import os
+import asyncio
 from dotenv import load_dotenv
-from utils import download_wikipedia_article
+from utils import download_wikipedia_article_async, get_wikipedia_word_counts_async, get_anthropic_client, run_sync, article_cache
+from usage import record_anthropic_usage
 
 load_dotenv()
-anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
 
 SYSTEM_PROMPT = "You are skilled at writing compelling, teaser-style introductions for literary and artistic works that intrigue readers without revealing everything."
 
-USER_PROMPT_TEMPLATE = """The official title of this work on Project Gutenberg is: "{gutenberg_title}"
-
-Please use this as the authoritative title in your introduction, even if the Wikipedia article uses a different title (this may occur due to language differences or variations in naming).
-
-I'm going to give you the first 1200 words of the Wikipedia article of this work.
+# The instructions are identical for every book and come first, the book-specific part (Gutenberg title and article)
+# follows. They aren't marked for Anthropic's prompt cache: it only caches prefixes of at least 1024 tokens (for
+# Sonnet) and the instructions are well below that, so a marker would only pretend to cache something.
+INSTRUCTIONS = """I'm going to give you the official title of a work on Project Gutenberg and the first 1200 words of the Wikipedia article of this work.
 Write an introduction-text for it that works like a movie trailer — giving a sense of what the work is about without revealing too much i.e. avoid spoilers. Write between 80-90 words. Do not exceed 90 words.
 
 If possible, the first sentence should follow this pattern: "(title)" by (author/composer) is a (type of work) written/published/composed in (time period).
@@ -36,7 +34,11 @@ Make sure to base EVERYTHING on the content of the Wikipedia article! Do NOT add
 
 Always write in English, even if the Wikipedia article is in a different language.
 
-It is possible that the Wikipedia article provided does not give you enough information to write a reasonable introduction-text based solely on it. It may be very short or may actually be about the author rather than the work or have some other flaw. At any rate, if the article doesn't provide you with enough information about the work itself, do NOT write an introduction text, but instead just return "insufficient information".
+It is possible that the Wikipedia article provided does not give you enough information to write a reasonable introduction-text based solely on it. It may be very short or may actually be about the author rather than the work or have some other flaw. At any rate, if the article doesn't provide you with enough information about the work itself, do NOT write an introduction text, but instead just return "insufficient information"."""
+
+WORK_PROMPT_TEMPLATE = """The official title of this work on Project Gutenberg is: "{gutenberg_title}"
+
+Please use this as the authoritative title in your introduction, even if the Wikipedia article uses a different title (this may occur due to language differences or variations in naming).
 
 <WIKIPEDIA ARTICLE>
 {article_text}
@@ -51,27 +53,41 @@ def truncate_to_words(text, word_limit):
     return ' '.join(words[:word_limit])
 
 
-def exclude_short_articles(wiki_links, min_word_count=230):
+async def exclude_short_articles_async(wiki_links, min_word_count=230):
     """Download Wikipedia articles and exclude those shorter than min_word_count."""
     if not wiki_links:
         return []
 
-    valid_articles = []
+    # Wikipedia's search index knows the word count of an article, articles that are clearly too short aren't downloaded.
+    # Articles already downloaded (usually while validating them) are counted below without asking.
+    uncached = [url for url in wiki_links if not article_cache.get(url)]
+    word_counts = await get_wikipedia_word_counts_async(uncached)
+    wiki_links = [url for url in wiki_links if word_counts.get(url) is None or word_counts[url] >= min_word_count]
 
-    for url in wiki_links:
-        try:
-            article_text = download_wikipedia_article(url)
-            word_count = len(article_text.split())
+    # Skip articles that fail to download, continue with others
+    downloads = await asyncio.gather(
+        *(download_wikipedia_article_async(url) for url in wiki_links),
+        return_exceptions=True
+    )
+
+    valid_articles = []
 
-            if word_count >= min_word_count:
-                valid_articles.append((article_text, word_count))
-        except Exception:
-            # Skip articles that fail to download, continue with others
+    for article_text in downloads:
+        if isinstance(article_text, Exception):
             continue
+        word_count = len(article_text.split())
+
+        if word_count >= min_word_count:
+            valid_articles.append((article_text, word_count))
 
     return valid_articles
 
 
+def exclude_short_articles(wiki_links, min_word_count=230):
+    """Download Wikipedia articles and exclude those shorter than min_word_count."""
+    return run_sync(exclude_short_articles_async(wiki_links, min_word_count))
+
+
 def pick_longest_article(articles):
     """Select the longest article from a list of (article_text, word_count) tuples."""
     if not articles:
@@ -81,16 +97,25 @@ def pick_longest_article(articles):
     return longest_article[0]
 
 
-def generate_wiki_based_summary(article_text, gutenberg_title):
+async def generate_wiki_based_summary_async(article_text, gutenberg_title):
     """Generate a wiki-based summary using Claude API."""
     truncated = truncate_to_words(article_text, 1200)
-    prompt = USER_PROMPT_TEMPLATE.format(gutenberg_title=gutenberg_title, article_text=truncated)
+    prompt = WORK_PROMPT_TEMPLATE.format(gutenberg_title=gutenberg_title, article_text=truncated)
 
-    message = anthropic_client.messages.create(
+    message = await get_anthropic_client().messages.create(
         model="claude-sonnet-4-5-20250929",
         max_tokens=400,
         system=SYSTEM_PROMPT,
-        messages=[{"role": "user", "content": prompt}]
+        messages=[{"role": "user", "content": [
+            {"type": "text", "text": INSTRUCTIONS},
+            {"type": "text", "text": prompt}
+        ]}]
     )
+    record_anthropic_usage("wiki summary", "claude-sonnet-4-5", message.usage)
 
     return message.content[0].text
+
+
+def generate_wiki_based_summary(article_text, gutenberg_title):
+    """Generate a wiki-based summary using Claude API."""
+    return run_sync(generate_wiki_based_summary_async(article_text, gutenberg_title))
@@ -5,18 +5,21 @@
 # Read the prompting for a better understanding.
 # We're feeding in the other books by the author to give Perplexity more context to find the correct Wikipedia link.
 # Results are validated in a basic way to avoid obvious mistakes.
+# Authors whose name and life dates match exactly one person in our local Wikidata extract (see wikidata_authors.py)
+# are resolved from it directly, without Perplexity.
+# The author's other books and existing links come from the local author catalogue (see author_catalogue.py),
+# the author's page on gutenberg.org is only scraped for authors the catalogue doesn't know yet.
 
-import requests
-from bs4 import BeautifulSoup
 import os
 from dotenv import load_dotenv
+import cpu_pool
+from utils import get_http_client, run_sync
+from author_catalogue import get_author
+from html_parsing import parse_author_page
+from wikidata_authors import resolve_author
+from results_writer import append_lines
 
 load_dotenv()
-perplexity_api_key = os.getenv("PERPLEXITY_API_KEY")
-
-# Validate API key exists
-if not perplexity_api_key:
-    raise ValueError("PERPLEXITY_API_KEY not found in environment variables")
 
 # Constants
 PERPLEXITY_MODEL = "sonar-pro"
@@ -42,6 +45,13 @@ WIKIPEDIA_NOT_FOUND_TEXTS = [
 ]
 
 
+def get_perplexity_api_key():
+    """Return the Perplexity API key, checked when it's first needed rather than at import."""
+    if not (api_key := os.getenv("PERPLEXITY_API_KEY")):
+        raise ValueError("PERPLEXITY_API_KEY not found in environment variables")
+    return api_key
+
+
 def parse_life_dates(life_dates):
     """Parse life dates string into (birth_year, death_year) tuple."""
     if not life_dates or '-' not in life_dates:
@@ -58,7 +68,7 @@ def extract_wikipedia_subdomain(wikipedia_url):
     return ".".join(wikipedia_url.split("/")[2].split(".")[:2])
 
 
-def query_perplexity_api(prompt):
+async def query_perplexity_api_async(prompt):
     """Call Perplexity API with given prompt and return response."""
     payload = {
         "model": PERPLEXITY_MODEL,
@@ -69,11 +79,11 @@ def query_perplexity_api(prompt):
         "stream": False,
     }
     headers = {
-        "Authorization": f"Bearer {perplexity_api_key}",
+        "Authorization": f"Bearer {get_perplexity_api_key()}",
         "Content-Type": "application/json"
     }
     try:
-        response = requests.post(
+        response = await get_http_client().post(
             "https://api.perplexity.ai/chat/completions",
             json=payload,
             headers=headers,
@@ -85,7 +95,12 @@ def query_perplexity_api(prompt):
         return "perplexity_error"
 
 
-def search_author_wikipedia(author_name, life_dates, book_titles):
+def query_perplexity_api(prompt):
+    """Call Perplexity API with given prompt and return response."""
+    return run_sync(query_perplexity_api_async(prompt))
+
+
+async def search_author_wikipedia_async(author_name, life_dates, book_titles):
     """Search for author Wikipedia link using Perplexity API."""
     birth_year, death_year = parse_life_dates(life_dates) if life_dates else (None, None)
 
@@ -108,30 +123,40 @@ Accept that first or middle names of the author may be abbreviated.
 
 {COMMON_INSTRUCTIONS}"""
 
-    return query_perplexity_api(prompt)
+    return await query_perplexity_api_async(prompt)
 
 
-def get_author_metadata(author_id):
+def search_author_wikipedia(author_name, life_dates, book_titles):
+    """Search for author Wikipedia link using Perplexity API."""
+    return run_sync(search_author_wikipedia_async(author_name, life_dates, book_titles))
+
+
+async def get_author_metadata_async(author_id):
     """Fetch book titles and check if author already has Wikipedia link."""
+    import httpx
+
+    if author_metadata := get_author(author_id):
+        return author_metadata
+
     headers = {'User-Agent': 'Mozilla/5.0 (compatible; GutenbergAuthor/1.0; +https://github.com)'}
     try:
-        response = requests.get(
+        response = await get_http_client().get(
             f"https://www.gutenberg.org/ebooks/author/{author_id}",
             headers=headers,
             timeout=REQUEST_TIMEOUT
         )
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
+        return await cpu_pool.call_async(parse_author_page, response.content)
+    except httpx.HTTPError:
+        return None
 
-        titles = [book.find("span", class_="title").text for book in soup.find_all("li", class_="booklink")]
-        has_wiki_link = any("wikipedia.org" in (link.get("href", "")) for link in soup.find_all("a"))
 
-        return {'book_titles': titles, 'has_wiki_link': has_wiki_link}
-    except requests.RequestException:
-        return None
+def get_author_metadata(author_id):
+    """Fetch book titles and check if author already has Wikipedia link."""
+    return run_sync(get_author_metadata_async(author_id))
 
 
-def is_valid_wikipedia_page(url):
+async def is_valid_wikipedia_page_async(url):
     """Validate that URL is a legitimate Wikipedia page."""
     if not url or len(url.strip().split()) != 1:
         return False
@@ -139,7 +164,7 @@ def is_valid_wikipedia_page(url):
     try:
         clean_url = url.split("#")[0]
         headers = {'User-Agent': 'Mozilla/5.0 (compatible; GutenbergAuthor/1.0; +https://github.com)'}
-        response = requests.get(clean_url, timeout=REQUEST_TIMEOUT, headers=headers)
+        response = await get_http_client().get(clean_url, timeout=REQUEST_TIMEOUT, headers=headers)
         response.raise_for_status()
 
         return not any(text in response.text for text in WIKIPEDIA_NOT_FOUND_TEXTS)
@@ -147,20 +172,34 @@ def is_valid_wikipedia_page(url):
         return False
 
 
+def is_valid_wikipedia_page(url):
+    """Validate that URL is a legitimate Wikipedia page."""
+    return run_sync(is_valid_wikipedia_page_async(url))
+
+
 def save_author_wiki_sql(author_id, wikipedia_url, results_file):
-    """Append SQL statement to results file."""
+    """Append SQL statement to results file (a path or a LineBuffer)."""
     wikipedia_subdomain = extract_wikipedia_subdomain(wikipedia_url)
     insert_statement = f"insert into author_urls (fk_authors, description, url) values ({author_id},'{wikipedia_subdomain}','{wikipedia_url}');"
-    with open(results_file, "a") as f:
-        f.write(insert_statement + "\n")
+    append_lines(results_file, [insert_statement])
 
 
-def get_author_wikipedia_link(author, author_metadata):
+async def get_author_wikipedia_link_async(author, author_metadata):
     """Find and validate Wikipedia link for an author."""
+    birth_year, death_year = parse_life_dates(author['life_dates'])
+    if wikipedia_url := resolve_author(author['name'], birth_year and int(birth_year), death_year and int(death_year)):
+        print(f"  Found {author['name']} in Wikidata")
+        return wikipedia_url
+
     print(f"  Searching for {author['name']}...")
-    wikipedia_url = search_author_wikipedia(
+    wikipedia_url = await search_author_wikipedia_async(
         author['name'],
         author['life_dates'],
         author_metadata['book_titles']
     )
-    return wikipedia_url if is_valid_wikipedia_page(wikipedia_url) else None
\ No newline at end of file
+    return wikipedia_url if await is_valid_wikipedia_page_async(wikipedia_url) else None
+
+
+def get_author_wikipedia_link(author, author_metadata):
+    """Find and validate Wikipedia link for an author."""
+    return run_sync(get_author_wikipedia_link_async(author, author_metadata))
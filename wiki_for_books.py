@@ -1,47 +1,107 @@
 # Finds Wikipedia links for books
-# We use Serper (Google search API) to search for wikipedia links related to the book.
+# We use Serper (Google search API) to search for wikipedia links related to the book. Results are cached locally.
 # Then we validate using Claude against full article content (first 3000 chars) using book title + authors.
+# Validation first asks a small model and only escalates to the large one when the small one isn't confident.
 # Validation stops at the first match per language set (English, then native language).
-# For non-English books, we search for both the English and the native language Wikipedia pages.
+# For non-English books, we search for both the English and the native language Wikipedia pages. Once one of them is
+# validated, the other is taken from its interlanguage links (the Wikipedia sidebar), only if there is no such link
+# do we validate the candidates from the search results for it as well.
 
 import re
-import anthropic
-import requests
+import asyncio
 import os
+from collections import Counter
 from dotenv import load_dotenv
-from utils import download_wikipedia_article
+from utils import (
+    download_wikipedia_article_async,
+    get_interlanguage_link_async,
+    get_anthropic_client,
+    get_http_client,
+    run_sync,
+    WIKIPEDIA_LANGUAGE_CODES
+)
+from usage import record_anthropic_usage
+from cache import DiskCache
+from results_writer import append_lines
 
 load_dotenv()
-anthropic_client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
 
+# Validation is a cascade: a small, fast model answers first and we only ask the next (larger) model when the
+# small one's confidence isn't in its "accept" set. The last tier's answer is always final.
+# VALIDATION_FAST_ACCEPT overrides the confidences accepted from the first tier, e.g. "HIGH,MEDIUM".
+VALIDATION_TIERS = [
+    {"model": "claude-haiku-4-5", "accept": {"HIGH"}},
+    {"model": "claude-sonnet-4-5-20250929", "accept": {"HIGH", "MEDIUM", "LOW"}},
+]
+if fast_accept := os.getenv("VALIDATION_FAST_ACCEPT"):
+    VALIDATION_TIERS[0]["accept"] = {confidence.strip().upper() for confidence in fast_accept.split(",")}
 
-def google_search_with_serper(query):
-    """Searches Google via Serper API and returns list of URLs."""
+validation_stats = Counter()
+
+# Search results are cached by normalised query, so reissued and multi-volume titles don't cost another search.
+# With SEARCH_CACHE_ONLY set, no searches are made at all and cached results are used regardless of their age.
+SEARCH_RESULTS = 20
+SEARCH_TIMEOUT = 15
+SEARCH_CACHE_TTL = 90 * 24 * 3600
+search_cache = DiskCache("serper_searches", ttl=SEARCH_CACHE_TTL)
+all_cached_searches = DiskCache("serper_searches")
+_searches_in_flight = {}
+
+
+def normalise_query(query):
+    """Normalise a search query so that trivially different spellings share a cache entry."""
+    return " ".join(query.casefold().split())
+
+
+async def _serper_request(query):
     headers = {
         'X-API-KEY': os.getenv("SERPER_API_KEY"),
         'Content-Type': 'application/json'
     }
-    response = requests.post(
+    response = await get_http_client().post(
         "https://google.serper.dev/search",
         headers=headers,
-        json={"q": query, "num": 20}
+        json={"q": query, "num": SEARCH_RESULTS},
+        timeout=SEARCH_TIMEOUT
     )
+    response.raise_for_status()
     return [result["link"] for result in response.json()["organic"]]
 
 
-def validate_with_claude(wiki_url, title, authors_str):
-    """Validate if Wikipedia article matches the book using Claude on full content."""
-    try:
-        validation_length = 3000
-        content = download_wikipedia_article(wiki_url)[:validation_length]
+async def google_search_with_serper_async(query):
+    """Searches Google via Serper API and returns list of URLs."""
+    key = normalise_query(query)
+    if (links := search_cache.get(key)) is not None:
+        return links
+    if os.getenv("SEARCH_CACHE_ONLY"):
+        if (links := all_cached_searches.get(key)) is not None:
+            return links
+        raise ValueError(f"No cached search results for: {query}")
+
+    # Books processed at the same time with the same query share one request
+    if key not in _searches_in_flight:
+        _searches_in_flight[key] = asyncio.ensure_future(_serper_request(query))
+        _searches_in_flight[key].add_done_callback(lambda _: _searches_in_flight.pop(key, None))
+    links = await asyncio.shield(_searches_in_flight[key])
+
+    search_cache.set(key, links)
+    return links
+
+
+def google_search_with_serper(query):
+    """Searches Google via Serper API and returns list of URLs."""
+    return run_sync(google_search_with_serper_async(query))
+
 
-        response = anthropic_client.messages.create(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=500,
-            system="You are a specialist at evaluating whether a certain Wikipedia article belongs to a specific literary work.",
-            messages=[{
-                "role": "user",
-                "content": f"""I would like to check whether a particular Wikipedia article is about a literary work that I've found on Project Gutenberg. I will give you basic information about that literary work and the first 3000 characters of the Wikipedia article.
+async def _ask_claude_for_verdict(model, content, title, authors_str):
+    """Ask one Claude model whether the article is about the book. Returns (verdict, confidence) or None if unparseable."""
+    response = await get_anthropic_client().messages.create(
+        model=model,
+        max_tokens=10,
+        system="You are a specialist at evaluating whether a certain Wikipedia article belongs to a specific literary work.",
+        messages=[{
+            "role": "user",
+            "content": f"""I would like to check whether a particular Wikipedia article is about a literary work that I've found on Project Gutenberg. I will give you basic information about that literary work and the first 3000 characters of the Wikipedia article.
 
 WORK (basic info):
 - Title: {title}
@@ -61,22 +121,59 @@ IMPORTANT: We want articles about the BOOK itself (its publication, literary sig
 
 Ignore minor edition details (translations, volumes, annotations).
 
-Respond:
-VERDICT: [YES/NO]
-CONFIDENCE: [HIGH/MEDIUM/LOW]
-REASONING: [one very short sentence]"""
-            }]
-        )
+Respond with exactly two words and nothing else: the verdict (YES or NO) followed by your confidence (HIGH, MEDIUM or LOW).
+Example: YES HIGH"""
+        }]
+    )
+    record_anthropic_usage("validation", model, response.usage)
+
+    answer = response.content[0].text
+    if match := re.search(r'\b(YES|NO)\b\W+(HIGH|MEDIUM|LOW)\b', answer, re.IGNORECASE):
+        return match.group(1).upper() == "YES", match.group(2).upper()
+    return None
+
+
+async def validate_with_claude_async(wiki_url, title, authors_str, max_tiers=None):
+    """Validate if Wikipedia article matches the book using Claude on full content.
 
-        answer = response.content[0].text
-        verdict_match = re.search(r'VERDICT:\s*(YES|NO)', answer, re.IGNORECASE)
-        result = verdict_match and verdict_match.group(1).upper() == "YES"
-        return result
+    Asks the models in VALIDATION_TIERS (only the first max_tiers of them if given) in order and stops at the first
+    one that is confident enough.
+    """
+    try:
+        validation_length = 3000
+        content = await download_wikipedia_article_async(wiki_url, max_chars=validation_length)
+
+        tiers = VALIDATION_TIERS[:max_tiers]
+        for tier, settings in enumerate(tiers):
+            is_last_tier = tier == len(tiers) - 1
+            answer = await _ask_claude_for_verdict(settings["model"], content, title, authors_str)
+            validation_stats[settings["model"]] += 1
+
+            if answer and (answer[1] in settings["accept"] or is_last_tier):
+                return answer[0]
+            if not is_last_tier:
+                validation_stats["escalated"] += 1
+        return False
 
     except Exception:
         return False
 
 
+def format_validation_report():
+    """Return a one-line summary of how many validations had to be escalated to a larger model."""
+    first_tier = validation_stats[VALIDATION_TIERS[0]["model"]]
+    if not first_tier:
+        return "Validation: no articles validated."
+    escalated = validation_stats["escalated"]
+    return (f"Validation: {first_tier} articles, {escalated} escalated past {VALIDATION_TIERS[0]['model']} ({escalated / first_tier:.0%}), "
+            f"{validation_stats['langlinks']} links taken from interlanguage links instead")
+
+
+def validate_with_claude(wiki_url, title, authors_str):
+    """Validate if Wikipedia article matches the book using Claude on full content."""
+    return run_sync(validate_with_claude_async(wiki_url, title, authors_str))
+
+
 def filter_wikipedia_urls(search_results):
     """Filter search results to valid Wikipedia article URLs."""
     unwanted_patterns = ["simple.", "File:", "/Category:", "(disambiguation)"]
@@ -86,45 +183,60 @@ def filter_wikipedia_urls(search_results):
     ]
 
 
-def find_first_matching_url(urls, book_title, authors_str, language_label):
+async def find_first_matching_url_async(urls, book_title, authors_str, language_label, max_tiers=None):
     """Check URLs and return first match, or None."""
     if not urls:
         return None
 
+    # Sequential on purpose: we stop paying for validations as soon as one matches.
     for url in urls:
-        if validate_with_claude(url, book_title, authors_str):
+        if await validate_with_claude_async(url, book_title, authors_str, max_tiers):
             return url
     return None
 
 
-def get_book_wikipedia_links(book_title, book_language, authors_str):
+def find_first_matching_url(urls, book_title, authors_str, language_label):
+    """Check URLs and return first match, or None."""
+    return run_sync(find_first_matching_url_async(urls, book_title, authors_str, language_label))
+
+
+async def get_book_wikipedia_links_async(book_title, book_language, authors_str, max_tiers=None):
     """Finds and validates Wikipedia links for book in English and native language using Claude."""
     print("  Searching and validating Wikipedia links...")
-    search_results = google_search_with_serper(f"{book_title} wikipedia")
+    search_results = await google_search_with_serper_async(f"{book_title} wikipedia")
     wiki_urls = filter_wikipedia_urls(search_results)
 
     english_wiki_urls = [url for url in wiki_urls if url.startswith("https://en.wikipedia.org/")]
     native_wiki_urls = [url for url in wiki_urls if not url.startswith("https://en.wikipedia.org/")]
 
-    validated_urls = []
+    english_url = await find_first_matching_url_async(english_wiki_urls, book_title, authors_str, "English", max_tiers)
+    if book_language == "English":
+        return [english_url] if english_url else []
+
+    # The validated English article usually links to the article in the book's language and vice versa
+    native_url = None
+    if english_url and (native_lang := WIKIPEDIA_LANGUAGE_CODES.get(book_language)):
+        native_url = await get_interlanguage_link_async(english_url, native_lang)
+    if native_url:
+        validation_stats["langlinks"] += 1
+    else:
+        native_url = await find_first_matching_url_async(native_wiki_urls, book_title, authors_str, book_language, max_tiers)
+        if native_url and not english_url and (english_url := await get_interlanguage_link_async(native_url, "en")):
+            validation_stats["langlinks"] += 1
 
-    # Check English URLs first
-    if english_match := find_first_matching_url(english_wiki_urls, book_title, authors_str, "English"):
-        validated_urls.append(english_match)
+    # English match first, then native language match
+    return [url for url in (english_url, native_url) if url]
 
-    # Check native language URLs if book is not English
-    if book_language != "English":
-        if native_match := find_first_matching_url(native_wiki_urls, book_title, authors_str, book_language):
-            validated_urls.append(native_match)
 
-    return validated_urls
+def get_book_wikipedia_links(book_title, book_language, authors_str):
+    """Finds and validates Wikipedia links for book in English and native language using Claude."""
+    return run_sync(get_book_wikipedia_links_async(book_title, book_language, authors_str))
 
 
 def save_book_wikis_sql(book_id, wiki_urls, output_file):
-    """Appends SQL INSERT for Wikipedia URLs to results file."""
+    """Appends SQL INSERT for Wikipedia URLs to results file (a path or a LineBuffer)."""
     if not wiki_urls:
         return
     urls_str = " ".join(wiki_urls)
-    sql = f"insert into attributes (fk_books,fk_attriblist,text,nonfiling) values ({book_id},500,'{urls_str}',0);\n"
-    with open(output_file, 'a') as f:
-        f.write(sql)
\ No newline at end of file
+    sql = f"insert into attributes (fk_books,fk_attriblist,text,nonfiling) values ({book_id},500,'{urls_str}',0);"
+    append_lines(output_file, [sql])
\ No newline at end of file
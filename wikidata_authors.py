@@ -0,0 +1,161 @@
+# Resolves authors to their Wikipedia article with a local extract of Wikidata.
+# Wikidata knows for most people their name (in many languages, plus aliases), year of birth and death and the
+# Wikipedia articles about them (sitelinks). That's exactly what Gutenberg tells us about an author, so an author
+# whose name and life dates match exactly one person in Wikidata is resolved without asking Perplexity.
+# Authors without life dates, with several matching people or without a match still go to Perplexity.
+# The extract holds only humans (P31 = Q5) with a year of birth or death and at least one Wikipedia article. It's
+# loaded into the local sqlite database from a Wikidata JSON dump (the full latest-all.json.gz or any dump in the
+# same one-entity-per-line format, e.g. a pre-filtered one):
+#   python wikidata_authors.py latest-all.json.gz
+
+import bz2
+import gzip
+import json
+import re
+import sys
+import unicodedata
+from urllib.parse import quote
+from cache import define_table, execute, execute_many
+from utils import WIKIPEDIA_LANGUAGE_CODES
+
+INSERT_BATCH_SIZE = 10000
+# Sitelink preference when a person has articles in several languages (Perplexity is asked for English or native too)
+PREFERRED_WIKIS = ["en", "de", "fr", "es", "it", "nl", "pt", "sv", "fi", "da", "no", "pl", "ru"]
+WIKIS = set(WIKIPEDIA_LANGUAGE_CODES.values())
+URL_SAFE_CHARACTERS = "()_,!'*-.:~"
+
+define_table("create table if not exists wikidata_people (qid text primary key, birth_year integer, death_year integer, sitelinks text)")
+define_table("create table if not exists wikidata_names (name_key text, qid text, primary key (name_key, qid))")
+
+
+def normalise_name(name):
+    """Lowercase name without accents, punctuation and extra whitespace ("Müller, J." -> "muller j")."""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", name.lower()).split())
+
+
+def gutenberg_name_keys(name):
+    """Return the normalised names to look up for a Gutenberg author name like "Chesterton, G. K. (Gilbert Keith)"."""
+    full_names = []
+    if match := re.match(r"^(.*?)\s*\((.+)\)\s*$", name):
+        name, expanded = match.group(1), match.group(2)
+        if "," in name:
+            full_names.append(f"{expanded} {name.split(',', 1)[0]}")
+        else:
+            full_names.append(expanded)
+
+    # Gutenberg puts the family name first: "Dickens, Charles" -> "Charles Dickens"
+    if "," in name:
+        family, given = name.split(",", 1)
+        full_names.insert(0, f"{given} {family}")
+    else:
+        full_names.insert(0, name)
+    return list(dict.fromkeys(normalise_name(full_name) for full_name in full_names if full_name.strip()))
+
+
+def _year(claims, prop):
+    for claim in claims.get(prop, []):
+        time_value = claim.get('mainsnak', {}).get('datavalue', {}).get('value', {}).get('time', "")
+        if match := re.match(r"^([+-]\d+)-", time_value):
+            return int(match.group(1))
+    return None
+
+
+def parse_entity(line):
+    """Return (qid, birth_year, death_year, sitelinks, name keys) for a human in a dump line, or None."""
+    line = line.strip().rstrip(",")
+    if not line.startswith("{") or '"Q5"' not in line:
+        return None
+    entity = json.loads(line)
+    claims = entity.get('claims', {})
+    if not any(claim.get('mainsnak', {}).get('datavalue', {}).get('value', {}).get('id') == "Q5" for claim in claims.get('P31', [])):
+        return None
+
+    birth_year, death_year = _year(claims, 'P569'), _year(claims, 'P570')
+    sitelinks = {
+        site[:-4]: link['title'] for site, link in entity.get('sitelinks', {}).items()
+        if site.endswith("wiki") and site[:-4] in WIKIS
+    }
+    if not sitelinks or (birth_year is None and death_year is None):
+        return None
+
+    names = [label['value'] for label in entity.get('labels', {}).values()]
+    names += [alias['value'] for aliases in entity.get('aliases', {}).values() for alias in aliases]
+    name_keys = {normalise_name(name) for name in names} - {""}
+    return entity['id'], birth_year, death_year, sitelinks, name_keys
+
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _store(people):
+    execute_many(
+        "insert or replace into wikidata_people (qid, birth_year, death_year, sitelinks) values (?, ?, ?, ?)",
+        [(qid, birth, death, json.dumps(sitelinks)) for qid, birth, death, sitelinks, _ in people]
+    )
+    execute_many(
+        "insert or ignore into wikidata_names (name_key, qid) values (?, ?)",
+        [(name_key, qid) for qid, *_, name_keys in people for name_key in name_keys]
+    )
+
+
+def load_dump(path):
+    """Load (or update) the extract from a Wikidata JSON dump. Returns the number of people stored."""
+    count = 0
+    batch = []
+    with _open_dump(path) as f:
+        for line in f:
+            if person := parse_entity(line):
+                batch.append(person)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                _store(batch)
+                count += len(batch)
+                batch = []
+    _store(batch)
+    return count + len(batch)
+
+
+def sitelink_url(lang, title):
+    """Return the Wikipedia URL of a sitelink title."""
+    return f"https://{lang}.wikipedia.org/wiki/{quote(title.replace(' ', '_'), safe=URL_SAFE_CHARACTERS)}"
+
+
+def _years_match(birth_year, death_year, person_birth, person_death):
+    """Whether all years known on both sides are equal, and at least one of them is known on both sides."""
+    pairs = [(year, person_year) for year, person_year in ((birth_year, person_birth), (death_year, person_death))
+             if year is not None and person_year is not None]
+    return bool(pairs) and all(year == person_year for year, person_year in pairs)
+
+
+def resolve_author(name, birth_year, death_year):
+    """Return the Wikipedia URL of the one person in the extract matching name and life years, or None."""
+    if birth_year is None and death_year is None:
+        return None  # a name alone is too ambiguous
+
+    matches = {}
+    for name_key in gutenberg_name_keys(name):
+        rows = execute(
+            """select p.qid, p.birth_year, p.death_year, p.sitelinks from wikidata_names n
+            join wikidata_people p on p.qid = n.qid where n.name_key = ?""",
+            (name_key,)
+        )
+        for qid, person_birth, person_death, sitelinks in rows:
+            if _years_match(birth_year, death_year, person_birth, person_death):
+                matches[qid] = json.loads(sitelinks)
+
+    if len(matches) != 1:
+        return None
+    sitelinks = next(iter(matches.values()))
+    lang = next((lang for lang in PREFERRED_WIKIS if lang in sitelinks), next(iter(sitelinks)))
+    return sitelink_url(lang, sitelinks[lang])
+
+
+if __name__ == "__main__":
+    count = load_dump(sys.argv[1])
+    print(f"Wikidata extract: {count} people loaded")